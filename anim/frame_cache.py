@@ -0,0 +1,84 @@
+import collections
+import hashlib
+import numpy as np
+import os
+from pathlib import Path
+
+# Generated frames are kept in cache/frames/ as uint8 .npy files, so a frame that
+# was rendered before, by any render, doesn't need the generator again.
+# Each checkpoint has its own folder, named after a hash of the checkpoint,
+# and each frame is named after a hash of its latent vector.
+#
+# The latent vectors of a path are matrix products, whose last bits can change with
+# the batch they were computed in, so they are rounded before they are hashed.
+# Latent vectors closer than that make the same frame anyway.
+#
+# The total size of the cache is kept under a limit by removing the least recently
+# used frames first. A frame is marked as used by touching its file, so the order
+# is shared by every process that uses the cache.
+CACHE_DIR = 'cache/frames'
+DECIMALS = 5
+
+
+def latent_key(latent):
+	# Adding 0 turns -0.0 into 0.0, which has other bytes.
+	rounded = np.round(latent.astype(np.float32), DECIMALS) + np.float32(0)
+	return hashlib.sha1(rounded.tobytes()).hexdigest()
+
+
+class FrameCache:
+
+	def __init__(self, checkpoint_id, max_size):
+		# max_size is in bytes, for the frames of every checkpoint together.
+		self.dir_cache = Path(CACHE_DIR, checkpoint_id)
+		self.max_size = max_size
+		os.makedirs(self.dir_cache, exist_ok=True)
+		# Every entry, least recently used first.
+		entries = []
+		for path in Path(CACHE_DIR).glob('*/*.npy'):
+			stat = path.stat()
+			entries.append((stat.st_mtime_ns, path, stat.st_size))
+		entries.sort()
+		self.entries = collections.OrderedDict((path, size) for _, path, size in entries)
+		self.size = sum(self.entries.values())
+
+	def path(self, latent):
+		return self.dir_cache / f'{latent_key(latent)}.npy'
+
+	def get(self, latents):
+		# Returns a list with the cached frame of each latent vector,
+		# or None where the frame isn't in the cache.
+		frames = []
+		for latent in latents:
+			path = self.path(latent)
+			try:
+				frame = np.load(path)
+				os.utime(path)
+				size = path.stat().st_size
+			except (OSError, ValueError):
+				# Not in the cache, or removed by another process in the meantime.
+				frames.append(None)
+				continue
+			self.entries.pop(path, None)
+			self.entries[path] = size
+			frames.append(frame)
+		return frames
+
+	def put(self, latents, frames):
+		# frames are uint8, in the same order as latents.
+		for latent, frame in zip(latents, frames):
+			path = self.path(latent)
+			tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+			with open(tmp, 'wb') as f:
+				np.save(f, frame)
+			os.replace(tmp, path)
+			size = path.stat().st_size
+			self.size += size - self.entries.pop(path, 0)
+			self.entries[path] = size
+		self.evict()
+
+	def evict(self):
+		while self.size > self.max_size and self.entries:
+			path, size = self.entries.popitem(last=False)
+			path.unlink(missing_ok=True)
+			self.size -= size
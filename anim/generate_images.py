@@ -1,8 +1,16 @@
 import argparse
 from checkpointer import Checkpointer
+import collections
+import concurrent.futures
+import frame_cache
+import hashlib
+import json
+import latent_path
+import numpy as np
 import os
 from pathlib import Path
 import pickle
+import sys
 import tensorflow as tf
 import time
 from train import TrainingState
@@ -10,152 +18,450 @@ from train import TrainingState
 
 # as per B.K.
 def load_generator(checkpoint_folder_path: os.PathLike, checkpoint_i):
+	# Returns the generator and an id of the checkpoint, a hash of its contents,
+	# which stays the same however the checkpoint was found.
 	checkpointer = Checkpointer(
 		os.path.join(checkpoint_folder_path, '{checkpoint_i}.checkpoint'))
 	if checkpoint_i is None:
 		checkpoint_i = max(checkpointer.list_checkpoints())
-	training_state: TrainingState = pickle.loads(checkpointer.load_checkpoint(checkpoint_i))
-	return training_state.visualization_generator
+	checkpoint = checkpointer.load_checkpoint(checkpoint_i)
+	checkpoint_id = hashlib.sha1(checkpoint).hexdigest()[:16]
+	training_state: TrainingState = pickle.loads(checkpoint)
+	return training_state.visualization_generator, checkpoint_id
+
+
+class FrameWriter:
+	# Converts frames to uint8, encodes them as .png and writes them on a pool of threads,
+	# while the generator works on the next batch. At most 2 batches per thread wait
+	# in the queue, so memory use stays flat no matter how many frames there are.
+
+	def __init__(self, dir_out, workers):
+		self.dir_out = dir_out
+		self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+		self.queue = collections.deque()
+		self.max_queue = 2 * workers
+
+	def write(self, start, image_batch):
+		# Frames are numbered from start.
+		while len(self.queue) >= self.max_queue:
+			self.queue.popleft().result()
+		self.queue.append(self.executor.submit(self.write_batch, start, image_batch))
+
+	def frame_path(self, i):
+		return os.path.join(self.dir_out, f'{i:06}.png')
+
+	def exists(self, start, count):
+		# Whether frames start to start + count were written by an earlier run.
+		return all(os.path.exists(self.frame_path(i)) for i in range(start, start + count))
+
+	def write_png(self, i, image):
+		# Written under a temporary name first, so an interrupted run never leaves half a frame.
+		file_path = self.frame_path(i)
+		with open(f'{file_path}.tmp', 'wb') as f:
+			f.write(tf.io.encode_png(image).numpy())
+		os.replace(f'{file_path}.tmp', file_path)
+
+	def write_batch(self, start, image_batch):
+		images = tf.image.convert_image_dtype(image_batch, tf.uint8, saturate=True)
+		for i, image in enumerate(images):
+			self.write_png(start + i, image)
+
+	def close(self):
+		while self.queue:
+			self.queue.popleft().result()
+		self.executor.shutdown()
+
+
+class VideoWriter(FrameWriter):
+	# Pipes frames straight into a video with FFmpeg, instead of writing a .png for each.
+	# Every keyframes-th frame is also written as .png, unless keyframes is 0.
+	# Frames have to reach FFmpeg in order, so there is only one thread.
+	# FFmpeg runs in a process of its own, so encoding still overlaps with the generator.
+	#
+	# With --part, each part has a video of its own, video-1-of-4.mp4 and so on.
+	# A video can't be continued, so a part is either skipped because its video
+	# is listed as done in the render's manifest, or rendered again from the start.
+
+	def __init__(self, dir_out, video, video_codec, crf, fps, keyframes, part):
+		super().__init__(dir_out, 1)
+		self.keyframes = keyframes
+		i, n = part
+		name = 'video' if n == 1 else f'video-{i}-of-{n}'
+		self.video_path = os.path.join(dir_out, f'{name}.{video}')
+		videos = load_manifest(dir_out).get('videos', [])
+		self.done = os.path.basename(self.video_path) in videos and os.path.exists(self.video_path)
+		self.frames = 0
+		self.options = {
+			'fps': fps,
+			'codec': video_codec,
+			'quality': None,
+			'pixelformat': 'yuv420p',
+			'output_params': ['-crf', str(crf)]}
+		self.video = None
+
+	def exists(self, start, count):
+		return self.done
+
+	def write_batch(self, start, image_batch):
+		import imageio
+		if self.video is None:
+			# Written under a temporary name until the video is complete.
+			stem, extension = os.path.splitext(self.video_path)
+			self.video = imageio.get_writer(f'{stem}.tmp{extension}', **self.options)
+		images = tf.image.convert_image_dtype(image_batch, tf.uint8, saturate=True)
+		for i, image in enumerate(images):
+			if self.keyframes and (start + i) % self.keyframes == 0:
+				self.write_png(start + i, image)
+			image = image.numpy()
+			if image.shape[-1] == 1:
+				image = image[..., 0]
+			self.video.append_data(image)
+			self.frames += 1
+
+	def close(self):
+		import imageio_ffmpeg
+		stem, extension = os.path.splitext(self.video_path)
+		tmp_path = f'{stem}.tmp{extension}'
+		try:
+			# The video is opened by the first batch on the writer thread,
+			# so it is only known whether there is one once the queue is empty.
+			super().close()
+			if self.video is None:
+				return
+			self.video.close()
+			# imageio doesn't report when FFmpeg fails, such as for a codec the container
+			# doesn't support, so the video is read back before it takes its final name.
+			try:
+				frames, _ = imageio_ffmpeg.count_frames_and_secs(tmp_path)
+			except RuntimeError:
+				frames = 0
+			if frames != self.frames:
+				raise RuntimeError(
+					f'FFmpeg wrote {frames} of {self.frames} frames to {self.video_path}. '
+					'See its output above.')
+		except Exception:
+			if self.video is not None:
+				self.video.close()
+			if os.path.exists(tmp_path):
+				os.remove(tmp_path)
+			raise
+		os.replace(tmp_path, self.video_path)
+		# Parts that finish at the same time may both rewrite the manifest, and one of
+		# them may be left out. That part is then rendered again, and nothing is lost.
+		manifest = load_manifest(self.dir_out)
+		manifest['videos'] = sorted(set(manifest.get('videos', [])) | {os.path.basename(self.video_path)})
+		save_manifest(self.dir_out, manifest)
+
+
+# Codec used for each type of video, unless --video_codec is given.
+VIDEO_CODECS = {'mp4': 'libx264', 'mkv': 'libx264', 'webm': 'libvpx-vp9'}
+
+
+def frame_writer(dir_out, args):
+	if args.video is None:
+		return FrameWriter(dir_out, args.workers)
+	return VideoWriter(
+		dir_out, args.video, args.video_codec, args.crf, args.fps, args.keyframes, args.part)
+
+
+def compile_generator(generator, batch_size):
+	# The generator as a tf.function with a fixed input shape,
+	# so it is traced once and every batch runs the same graph.
+	signature = tf.TensorSpec((batch_size, generator.input_shape[-1]), tf.float32)
+
+	@tf.function(input_signature=[signature])
+	def generate(latents):
+		return generator(latents)
+
+	return generate
+
+
+def available_memory():
+	# Free memory on the host in bytes. Where the system doesn't report it,
+	# a quarter of the physical memory is assumed to be free.
+	try:
+		return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+	except (ValueError, OSError):
+		return os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 4
+
+
+def peak_rss():
+	# Most memory this process has held at once, in bytes, or 0 where it isn't reported.
+	try:
+		import resource
+	except ImportError:
+		return 0
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# In bytes on macOS, and in KB elsewhere.
+	return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Larger batches hardly ever run faster on a CPU, and each one takes more host memory.
+MAX_CPU_BATCH_SIZE = 64
+
+
+def probe_batch_size(generator, limit):
+	# Doubles the batch size from 1 until a batch no longer fits in memory,
+	# a larger batch no longer generates frames faster, or the batch would exceed limit.
+	# On a GPU, a batch that doesn't fit raises ResourceExhaustedError.
+	# TensorFlow doesn't track host memory, so on a CPU the memory a batch takes
+	# is the growth in peak memory of the process. The next size is only tried
+	# if twice that is still free, and never past MAX_CPU_BATCH_SIZE.
+	gpu = bool(tf.config.list_logical_devices('GPU'))
+	if not gpu:
+		limit = min(limit, MAX_CPU_BATCH_SIZE)
+	base_rss = peak_rss()
+	batch_size = 1
+	best_size = 1
+	best_rate = 0
+	while batch_size <= limit:
+		try:
+			generate = compile_generator(generator, batch_size)
+			latents = tf.zeros((batch_size, generator.input_shape[-1]))
+			# The first call traces the function, so only the second is timed.
+			generate(latents)
+			t0 = time.perf_counter()
+			generate(latents).numpy()
+			rate = batch_size / (time.perf_counter() - t0)
+		except tf.errors.ResourceExhaustedError:
+			break
+		print(f'batch size {batch_size}: {rate:.1f} frames/s')
+		if rate < best_rate * 1.05:
+			break
+		best_size = batch_size
+		best_rate = rate
+		if not gpu and 2 * (peak_rss() - base_rss) > available_memory():
+			break
+		batch_size *= 2
+	print(f'batch size: {best_size}')
+	return best_size
+
+
+def part_range(frames, part):
+	# Part i of n gets the i-th of n runs of frames that are as even as possible.
+	i, n = part
+	return frames * (i - 1) // n, frames * i // n
+
+
+def generate_missing(generate, batch_size, waiting, cache):
+	# Generates up to batch_size of the frames that the waiting batches
+	# didn't find in the cache, in order, and adds them to the cache.
+	# waiting holds (start, latents, frames), where frames is None for a missing frame.
+	missing = [
+		(frames, i, latents[i]) for _, latents, frames in waiting
+		for i, frame in enumerate(frames) if frame is None][:batch_size]
+	latents = np.stack([latent for _, _, latent in missing])
+	count = len(latents)
+	# The last batch is padded to the same shape, so nothing is traced again.
+	if count < batch_size:
+		latents = np.pad(latents, ((0, batch_size - count), (0, 0)))
+	image_batch = generate(latents)[:count]
+	image_batch = tf.image.convert_image_dtype(image_batch, tf.uint8, saturate=True).numpy()
+	cache.put(latents[:count], image_batch)
+	for (frames, i, _), image in zip(missing, image_batch):
+		frames[i] = image
+	return count
+
+
+def write_ready(waiting, writer, prog_bar):
+	# Writes the waiting batches at the front that have all their frames.
+	while waiting and all(frame is not None for frame in waiting[0][2]):
+		start, _, frames = waiting.popleft()
+		writer.write(start, np.stack(frames))
+		prog_bar.add(len(frames))
+
+
+def render(generator, path, writer, batch_size, part=(1, 1), cache=None, max_waiting=4):
+	# Generates a frame for each latent vector of a latent_path.LatentPath, batch_size at a time,
+	# and hands each batch to the writer as soon as it is ready.
+	# batch_size is a number, or 'auto' to find the best one for this machine.
+	# Only the frames of the given part are rendered, and batches of frames
+	# that already exist are skipped.
+	#
+	# With a frame_cache.FrameCache, frames are read from the cache where they can be.
+	# The frames that are missing are pooled across batches, and only generated once
+	# there are batch_size of them, so the generator only runs for new frames.
+	# Batches wait until all their frames are ready, and are written in order.
+	# At most max_waiting batches wait, so memory stays flat however sparse the misses are.
+	start, stop = part_range(len(path), part)
+	if batch_size == 'auto':
+		batch_size = probe_batch_size(generator, stop - start)
+	generate = compile_generator(generator, batch_size)
+	prog_bar = tf.keras.utils.Progbar(stop - start)
+	waiting = collections.deque()
+	missing = 0
+	for start, latents in path.batches(batch_size, start, stop):
+		count = len(latents)
+		if writer.exists(start, count):
+			prog_bar.add(count)
+			continue
+		if cache is None:
+			# The last batch is padded to the same shape, so nothing is traced again.
+			if count < batch_size:
+				latents = np.pad(latents, ((0, batch_size - count), (0, 0)))
+			writer.write(start, generate(latents)[:count])
+			prog_bar.add(count)
+			continue
+		frames = cache.get(latents)
+		waiting.append((start, latents, frames))
+		missing += sum(frame is None for frame in frames)
+		if missing >= batch_size or (missing and len(waiting) > max_waiting):
+			missing -= generate_missing(generate, batch_size, waiting, cache)
+		write_ready(waiting, writer, prog_bar)
+	while missing:
+		missing -= generate_missing(generate, batch_size, waiting, cache)
+	write_ready(waiting, writer, prog_bar)
+	writer.close()
+
+
+def manifest_path(dir_out):
+	return os.path.join(dir_out, 'manifest.json')
+
+
+def load_manifest(dir_out):
+	with open(manifest_path(dir_out), 'r') as json_file:
+		return json.load(json_file)
+
+
+def save_manifest(dir_out, manifest):
+	# Written to a temporary file first, so an interrupted run never leaves half a manifest.
+	path = manifest_path(dir_out)
+	with open(f'{path}.{os.getpid()}', 'w') as json_file:
+		json.dump(manifest, json_file, indent=4)
+	os.replace(f'{path}.{os.getpid()}', path)
+
+
+VIDEO_OPTIONS = ['video', 'video_codec', 'crf', 'fps', 'keyframes']
+
+
+def render_dir(dir_root, img_type, args, count, noise_shape):
+	# Each render has a folder of its own, named after the seed. Its manifest records
+	# the parameters and the checkpoint, and the random latent vectors are saved in latents.npy.
+	# Running again with the same seed and parameters finds the same folder,
+	# and the latent vectors are read back, so the render continues where it stopped.
+	# A folder is never continued with other parameters, or another checkpoint,
+	# such as a newer one found when --checkpoint isn't given. Video options don't
+	# change the frames, so the same frames can be written again as a video.
+	seed = args.seed
+	if seed is None:
+		seed = int(np.random.default_rng().integers(2**32))
+		print(f'seed: {seed}')
+	dir_out = os.path.join(dir_root, img_type, f'seed{seed}')
+	latents_path = os.path.join(dir_out, 'latents.npy')
+	manifest = {
+		key: value for key, value in vars(args).items()
+		if key not in ['action', 'batch_size', 'workers', 'part', 'cache_size']}
+	manifest.update(seed=seed, latents=count, noise_shape=noise_shape)
+	if os.path.exists(manifest_path(dir_out)):
+		existing = load_manifest(dir_out)
+		changed = [
+			key for key, value in manifest.items()
+			if key not in VIDEO_OPTIONS and existing.get(key) != value]
+		if changed:
+			raise ValueError(
+				f'{dir_out} was rendered with other {", ".join(changed)}. '
+				'Use another --seed, or remove the folder to start over.')
+		print(f'continuing {dir_out}')
+		return dir_out, np.load(latents_path)
+
+	# Parts on other machines may start at the same time. They all compute
+	# the same latent vectors from the seed, and each file is replaced whole.
+	os.makedirs(dir_out, exist_ok=True)
+	latents = np.random.default_rng(seed).standard_normal((count, noise_shape), dtype=np.float32)
+	np.save(f'{latents_path}.{os.getpid()}.npy', latents)
+	os.replace(f'{latents_path}.{os.getpid()}.npy', latents_path)
+	save_manifest(dir_out, manifest)
+	return dir_out, latents
 
 
 def random(
   		generator: tf.keras.Model,
-		args:argparse.Namespace):
+		args:argparse.Namespace,
+		cache):
 	img_gen = Path(args.dir_in).stem
 	img_type = f'random_{args.count}'
 	if args.checkpoint is not None:
 		img_type = f'{img_type}_c{args.checkpoint}'
 	if args.set_no is not None:
 		img_type = f'{img_type}_{args.set_no}'
-	dir_out = os.path.join('out', img_gen, img_type, f'{int(time.time())}')
+	dir_root = os.path.join('out', img_gen)
 	if args.dir_out is not None:
-		dir_out = os.path.join(args.dir_out, img_type, f'{int(time.time())}')
-	os.makedirs(dir_out, exist_ok=True)
+		dir_root = args.dir_out
 	noise_shape = generator.input_shape[-1]
-	noises = tf.random.normal((args.count, noise_shape))
-	total_vectors = noises.shape[0]
-	batch_size = 4 # adjust according to GPU capacity
-	prog_bar = tf.keras.utils.Progbar(total_vectors // batch_size)
-	images = []
-	for start in range(0, total_vectors, batch_size):
-		end = start + batch_size
-		batch = noises[start:end]
-		image_batch = generator(batch)
-		prog_bar.add(1)
-		images.append(image_batch)
-	images = tf.concat(images, axis=0)
-	prog_bar = tf.keras.utils.Progbar(images.shape[0])
-	for image_i, image in enumerate(images):
-		file_path = os.path.join(dir_out, f'{image_i:06}.png')
-		image = tf.convert_to_tensor(image)
-		image = tf.image.convert_image_dtype(image, tf.uint8, saturate=True)
-		image = tf.io.encode_png(image).numpy()
-		with open(file_path, 'wb') as f:
-			    f.write(image)
-		prog_bar.add(1)
+	dir_out, noises = render_dir(dir_root, img_type, args, args.count, noise_shape)
+	batch_size = args.batch_size or 4
+	render(
+		generator,
+		latent_path.points(noises),
+		FrameWriter(dir_out, args.workers),
+		batch_size,
+		args.part,
+		cache)
 
   
-def zigzag(
+def animate(
 		generator: tf.keras.Model,
-		args:argparse.Namespace):
-	img_gen = Path(args.dir_in).stem
-	img_type = f'zigzag_s{args.segments}_f{args.frames}'
+		args:argparse.Namespace,
+		cache,
+		img_type,
+		count,
+		make_path,
+		batch_size):
+	# count random latent vectors are drawn, and make_path turns them into a path.
 	if args.checkpoint is not None:
 		img_type = f'{img_type}_c{args.checkpoint}'
-	dir_out = os.path.join('out', img_gen, img_type, f'{int(time.time())}')
-	os.makedirs(dir_out, exist_ok=True)
-
+	if args.video is not None and args.video_codec is None:
+		args.video_codec = VIDEO_CODECS[args.video]
+	dir_root = os.path.join('out', Path(args.dir_in).stem)
 	noise_shape = generator.input_shape[-1]
-	noises = tf.random.normal((args.segments, noise_shape))
-	interp_path = []
-	for i in range(noises.shape[0] - 1):
-		segment = tf.linspace(noises[i], noises[i+1], args.frames)
-		interp_path.append(segment)
-	interp_path = tf.concat(interp_path, axis=0)
-
-	total_vectors = interp_path.shape[0]
-	batch_size = 8 # adjust according to GPU capacity
-	prog_bar = tf.keras.utils.Progbar(total_vectors // batch_size)
-	images = []
-	for start in range(0, total_vectors, batch_size):
-		end = start + batch_size
-		batch = interp_path[start:end]
-		image_batch = generator(batch)
-		prog_bar.add(1)
-		images.append(image_batch)
-	images = tf.concat(images, axis=0)
-	prog_bar = tf.keras.utils.Progbar(images.shape[0])
-	for image_i, image in enumerate(images):
-		file_path = os.path.join(dir_out, f'{image_i:06}.png')
-		image = tf.convert_to_tensor(image)
-		image = tf.image.convert_image_dtype(image, tf.uint8, saturate=True)
-		image = tf.io.encode_png(image).numpy()
-		with open(file_path, 'wb') as f:
-		        f.write(image)
-		prog_bar.add(1)
-
-
-def bezier_interpolation(p0, p1, p2, p3, p4, frames):
-	segment = []
-	t_intervals = tf.linspace(0.0, 1.0, frames)
-	for t in t_intervals:
-		B_t = (
-		    1 * (1 - t)**4 * t**0 * p0 +
-		    4 * (1 - t)**3 * t**1 * p1 +
-		    6 * (1 - t)**2 * t**2 * p2 +
-		    4 * (1 - t)**1 * t**3 * p3 +
-		    1 * (1 - t)**0 * t**4 * p4
-		)
-		segment.append(B_t)
-		#print(f'segment shape: ({len(segment)}, {len(segment[0])})')
-	return segment
+	dir_out, noises = render_dir(dir_root, img_type, args, count, noise_shape)
+	path = make_path(noises, args.frames)
+	render(generator, path, frame_writer(dir_out, args), batch_size, args.part, cache)
 
 
-def bezier(
+def zigzag(
 		generator: tf.keras.Model,
-		args:argparse.Namespace):
+		args:argparse.Namespace,
+		cache):
+	batch_size = args.batch_size or 8
+	img_type = f'zigzag_s{args.segments}_f{args.frames}'
+	animate(generator, args, cache, img_type, args.segments, latent_path.zigzag, batch_size)
 
-	img_gen = Path(args.dir_in).stem
+
+def bezier(
+		generator: tf.keras.Model,
+		args:argparse.Namespace,
+		cache):
+	batch_size = args.batch_size or 16
 	img_type = f'bezier_s{args.segments}_f{args.frames}'
-	if args.checkpoint is not None:
-		img_type = f'{img_type}_c{args.checkpoint}'
-	dir_out = os.path.join('out', img_gen, img_type, f'{int(time.time())}')
-	os.makedirs(dir_out, exist_ok=True)
+	animate(generator, args, cache, img_type, args.segments * 3, latent_path.bezier, batch_size)
+
+
+def slerp(
+		generator: tf.keras.Model,
+		args:argparse.Namespace,
+		cache):
+	batch_size = args.batch_size or 8
+	img_type = f'slerp_s{args.segments}_f{args.frames}'
+	animate(generator, args, cache, img_type, args.segments, latent_path.slerp, batch_size)
+
+
+def catmull_rom(
+		generator: tf.keras.Model,
+		args:argparse.Namespace,
+		cache):
+	batch_size = args.batch_size or 8
+	img_type = f'catmull_rom_s{args.segments}_f{args.frames}'
+	animate(generator, args, cache, img_type, args.segments, latent_path.catmull_rom, batch_size)
+
+
+def part_arg(value):
+	# --part i/n, with i from 1 to n.
+	i, n = (int(x) for x in value.split('/'))
+	if not 1 <= i <= n:
+		raise argparse.ArgumentTypeError(f'part must be between 1/{n} and {n}/{n}')
+	return i, n
 
-	noise_shape = generator.input_shape[-1]
-	noises = tf.random.normal((args.segments * 3, noise_shape))
-	path = []
-	prog_bar = tf.keras.utils.Progbar(args.segments)
-	for i in range(args.segments):
-		p0 = noises[3*i-1]
-		p1 = p0 + (p0 - noises[3*i-2])
-		p2 = noises[3*i]
-		p3 = noises[3*i+1]
-		p4 = noises[3*i+2]
-		path.extend(bezier_interpolation(p0, p1, p2, p3, p4, args.frames))
-		prog_bar.add(1)
-	#print(f'path shape: ({len(path)}, {len(path[0])})')
-	batch_size = 16 # according to GPU capacity
-	prog_bar = tf.keras.utils.Progbar(args.segments * args.frames // batch_size)
-	path = tf.convert_to_tensor(path)
-	#print(f'tf path shape: ', path.shape)
-	for start in range(0, path.shape[0], batch_size):
-		images = []
-		end = start + batch_size
-		batch = path[start:end]
-		image_batch = generator(batch)
-		images.append(image_batch)
-		prog_bar.add(1)
-
-		images = tf.concat(images, axis=0)
-		for i, image in enumerate(images):
-		    img_no = start + i
-		    file_path = os.path.join(dir_out, f'{img_no:06}.png')
-		    image = tf.convert_to_tensor(image)
-		    image = tf.image.convert_image_dtype(image, tf.uint8, saturate=True)
-		    image = tf.io.encode_png(image).numpy()
-		    with open(file_path, 'wb') as f:
-		        f.write(image)
 
 def main():
 
@@ -199,7 +505,20 @@ def main():
 		help='Pass through a set of randomly chosen points in the latent space along a curved path.')
 	bezier_parser.set_defaults(action=bezier)
 
-	for subparser in [zigzag_parser, bezier_parser]:
+	slerp_parser = subparsers.add_parser(
+		'slerp',
+		help='Pass through a set of randomly chosen points in the latent space. Each path between ' +
+		     'adjacent points is an arc, which keeps to the typical length of a latent vector.')
+	slerp_parser.set_defaults(action=slerp)
+
+	catmull_rom_parser = subparsers.add_parser(
+		'catmull_rom',
+		help='Pass through a set of randomly chosen points in the latent space along a smooth ' +
+		     'Catmull-Rom spline, which loops back to the first point.')
+	catmull_rom_parser.set_defaults(action=catmull_rom)
+
+	path_parsers = [zigzag_parser, bezier_parser, slerp_parser, catmull_rom_parser]
+	for subparser in path_parsers:
 		subparser.add_argument(
 			'-s',
 			'--segments',
@@ -214,8 +533,42 @@ def main():
 			default=256,
 			help='Number of frames per segment.'
 		)
+		subparser.add_argument(
+			'-v',
+			'--video',
+			type=str,
+			choices=['mp4', 'mkv', 'webm'],
+			default=None,
+			help='Write a video of this type instead of a .png for every frame. Needs FFmpeg.'
+		)
+		subparser.add_argument(
+			'--video_codec',
+			type=str,
+			default=None,
+			help='FFmpeg video codec, such as libx264, libx265 or libvpx-vp9. ' +
+				'Defaults to libx264 for mp4 and mkv, and libvpx-vp9 for webm.'
+		)
+		subparser.add_argument(
+			'--crf',
+			type=int,
+			default=18,
+			help='Constant rate factor of the video. Lower is better quality and larger files.'
+		)
+		subparser.add_argument(
+			'--fps',
+			type=int,
+			default=30,
+			help='Frames per second of the video.'
+		)
+		subparser.add_argument(
+			'-k',
+			'--keyframes',
+			type=int,
+			default=0,
+			help='With --video, also write every nth frame as .png. 0 writes none.'
+		)
 
-	for subparser in [random_parser, zigzag_parser, bezier_parser]:
+	for subparser in [random_parser, *path_parsers]:
 		subparser.add_argument(
 			'-ch',
 			'--checkpoint',
@@ -223,6 +576,43 @@ def main():
 			default=None,
 			help='Checkpoint within dir_in. Defaults to highest value.'
 		)
+		subparser.add_argument(
+			'--seed',
+			type=int,
+			default=None,
+			help='Seed for the random latent vectors. If not specified, a random seed is used ' +
+				'and printed. Run again with the same seed to continue an interrupted render.'
+		)
+		subparser.add_argument(
+			'-p',
+			'--part',
+			type=part_arg,
+			default=(1, 1),
+			help='Render only part i of n of the frames, given as i/n, such as 2/4. ' +
+				'Give every part the same --seed.'
+		)
+		subparser.add_argument(
+			'-b',
+			'--batch_size',
+			type=lambda value: value if value == 'auto' else int(value),
+			default=None,
+			help='Images generated at once. "auto" finds the largest batch that fits in memory ' +
+				'and still speeds things up. Defaults to 4 for random, 16 for bezier and 8 otherwise.'
+		)
+		subparser.add_argument(
+			'-w',
+			'--workers',
+			type=int,
+			default=os.cpu_count(),
+			help='Threads that encode and write images while the next batch is generated.'
+		)
+		subparser.add_argument(
+			'--cache_size',
+			type=float,
+			default=None,
+			help='Keep generated frames in cache/frames, up to this many GB, and reuse them ' +
+				'in later renders with the same checkpoint. Off if not specified.'
+		)
 		subparser.add_argument(
 			'dir_in',
 			help='Path to image generator folder. The folder must contain a .checkpoint file.'
@@ -230,8 +620,13 @@ def main():
 
 	args = parser.parse_args()
 
-	generator = load_generator(args.dir_in, args.checkpoint)
-	args.action(generator, args)
+	generator, checkpoint_id = load_generator(args.dir_in, args.checkpoint)
+	# Recorded in the manifest of every render, which is only continued with the same checkpoint.
+	args.checkpoint_id = checkpoint_id
+	cache = None
+	if args.cache_size is not None:
+		cache = frame_cache.FrameCache(checkpoint_id, int(args.cache_size * 1e9))
+	args.action(generator, args, cache)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,126 @@
+import math
+import numpy as np
+
+# Paths through the latent space, computed a segment at a time.
+# Every segment is a (frames x k) matrix of weights times its (k x dim) control points,
+# so all of a segment's latent vectors come from a single matrix product.
+# Only one segment is held in memory at once, however long the path is.
+
+
+def steps(frames, endpoint=True):
+	# Positions 0 to 1 along a segment. Without the endpoint, the last frame of one
+	# segment isn't repeated as the first frame of the next.
+	return np.linspace(0.0, 1.0, frames, endpoint=endpoint, dtype=np.float32)
+
+
+def bernstein(t, degree):
+	# Bezier weights of the degree + 1 control points, one row per t.
+	binomial = np.array([math.comb(degree, i) for i in range(degree + 1)], dtype=np.float32)
+	k = np.arange(degree + 1, dtype=np.float32)
+	return binomial * (1 - t[:, None])**(degree - k) * t[:, None]**k
+
+
+def slerp_weights(t, p0, p1):
+	# Spherical interpolation from p0 to p1, as weights of the two points.
+	# Falls back to linear weights if the points are in the same direction.
+	cos = np.dot(p0, p1) / (np.linalg.norm(p0) * np.linalg.norm(p1))
+	omega = np.arccos(np.clip(cos, -1, 1))
+	if np.sin(omega) < 1e-6:
+		return bernstein(t, 1)
+	return np.stack([np.sin((1 - t) * omega), np.sin(t * omega)], axis=1) / np.sin(omega)
+
+
+def catmull_rom_weights(t):
+	# Weights of p[i-1], p[i], p[i+1] and p[i+2] for the segment from p[i] to p[i+1].
+	t = t[:, None]
+	return 0.5 * np.concatenate([
+		-t**3 + 2 * t**2 - t,
+		3 * t**3 - 5 * t**2 + 2,
+		-3 * t**3 + 4 * t**2 + t,
+		t**3 - t**2], axis=1)
+
+
+class LatentPath:
+	# count segments of frames latent vectors each.
+	# segment(i) returns the weights and control points of segment i.
+
+	def __init__(self, count, frames, segment):
+		self.count = count
+		self.frames = frames
+		self.segment = segment
+
+	def __len__(self):
+		return self.count * self.frames
+
+	def batches(self, batch_size, start=0, stop=None):
+		# Yields (start, latents), where start is the index of the first latent vector,
+		# for the latent vectors from start to stop.
+		# Every batch has batch_size latent vectors, except maybe the last.
+		# Only the rows of the weights that go into the current batch are multiplied,
+		# so a batch may take the end of one segment and the start of the next.
+		if stop is None:
+			stop = len(self)
+		buffer = []
+		buffered = 0
+		for i in range(start // self.frames, -(-stop // self.frames)):
+			weights, points = self.segment(i)
+			row = max(start - i * self.frames, 0)
+			end = min(stop - i * self.frames, len(weights))
+			while row < end:
+				take = min(batch_size - buffered, end - row)
+				buffer.append(weights[row:row + take] @ points)
+				row += take
+				buffered += take
+				if buffered == batch_size:
+					yield start, np.concatenate(buffer)
+					start += batch_size
+					buffer = []
+					buffered = 0
+		if buffered:
+			yield start, np.concatenate(buffer)
+
+
+def points(latents):
+	# Every latent vector is a frame of its own, as for a set of random images.
+	one = np.ones((1, 1), dtype=np.float32)
+	return LatentPath(len(latents), 1, lambda i: (one, latents[i:i + 1]))
+
+
+def zigzag(latents, frames):
+	# Straight lines from each point to the next.
+	weights = bernstein(steps(frames), 1)
+	return LatentPath(len(latents) - 1, frames, lambda i: (weights, latents[i:i + 2]))
+
+
+def bezier(latents, frames):
+	# A loop of degree 4 Bezier curves, with 3 points from latents for each segment.
+	# Each segment starts where the previous one ended, and its first control point
+	# mirrors the last one of the previous segment, so the path doesn't turn suddenly.
+	weights = bernstein(steps(frames), 4)
+
+	def segment(i):
+		p0 = latents[3*i-1]
+		p1 = p0 + (p0 - latents[3*i-2])
+		return weights, np.stack([p0, p1, latents[3*i], latents[3*i+1], latents[3*i+2]])
+
+	return LatentPath(len(latents) // 3, frames, segment)
+
+
+def slerp(latents, frames):
+	# Arcs from each point to the next. Random normal latent vectors are all about
+	# the same length, and an arc keeps to that length where a straight line would cut inside.
+	t = steps(frames)
+
+	def segment(i):
+		control = latents[i:i + 2]
+		return slerp_weights(t, *control), control
+
+	return LatentPath(len(latents) - 1, frames, segment)
+
+
+def catmull_rom(latents, frames):
+	# A smooth loop that passes through every point.
+	t = steps(frames, endpoint=False)
+	weights = catmull_rom_weights(t)
+	n = len(latents)
+	return LatentPath(n, frames, lambda i: (weights, latents[[(i - 1) % n, i, (i + 1) % n, (i + 2) % n]]))
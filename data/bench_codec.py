@@ -0,0 +1,112 @@
+import argparse
+import codec
+import extract
+import numpy as np
+import os
+import page_cache
+from PIL import Image
+import random
+import tile
+import time
+
+
+def bench(args: argparse.Namespace):
+	# Sample tiles evenly from every page, cut as tile.py blob would.
+	pages = len(os.listdir(args.dir_in))
+	rng = random.Random(0)
+	tiles = []
+	for page in range(pages):
+		_, ys, xs = tile.blob_geometry(
+			args.dpi, args.rows, args.cols, args.pixels, args.steps, page)
+		count = args.count // pages + (page < args.count % pages)
+		xs_sample = [rng.choice(xs) for _ in range(count)]
+		ys_sample = [rng.choice(ys) for _ in range(count)]
+		thetas = [rng.randrange(360) for _ in range(count)]
+		flips = [rng.randrange(2) for _ in range(count)]
+		img = page_cache.load_page(f'{args.dir_in}/{page:02}.png')
+		for t in extract.cut_tiles(img, xs_sample, ys_sample, thetas, flips, args.pixels):
+			tiles.append(Image.fromarray(t))
+
+	print(f'{len(tiles)} tiles of {args.pixels} x {args.pixels} px')
+	print(f'{"codec":<10}{"level":>6}{"encode/s":>12}{"decode/s":>12}{"bytes/tile":>14}')
+	for tile_codec in args.codecs:
+		levels = args.levels if tile_codec != 'raw' else [0]
+		for level in levels:
+			t0 = time.perf_counter()
+			encoded = [codec.encode(t, tile_codec, level) for t in tiles]
+			t1 = time.perf_counter()
+			decoded = [codec.decode(data, tile_codec) for data in encoded]
+			t2 = time.perf_counter()
+			# Every codec is lossless.
+			assert all(np.array_equal(np.asarray(t), d) for t, d in zip(tiles, decoded))
+			size = sum(map(len, encoded)) / len(encoded)
+			print(
+				f'{tile_codec:<10}{level:>6}{len(tiles) / (t1 - t0):>12.1f}' +
+				f'{len(tiles) / (t2 - t1):>12.1f}{size:>14.0f}')
+
+
+def main():
+
+	parser = argparse.ArgumentParser(
+		description='Measure encode speed, decode speed and size of each tile codec.')
+
+	parser.add_argument(
+		'-p',
+		'--pixels',
+		type=int,
+		default=512,
+		help='Square pixels of each tile.')
+	parser.add_argument(
+		'-s',
+		'--steps',
+		type=int,
+		default=16,
+		help='Steps, as in tile.py blob.')
+	parser.add_argument(
+		'-n',
+		'--count',
+		type=int,
+		default=256,
+		help='Number of tiles, sampled from all pages.')
+	parser.add_argument(
+		'-k',
+		'--codecs',
+		type=str,
+		nargs='+',
+		choices=list(codec.EXTENSIONS),
+		default=list(codec.EXTENSIONS),
+		help='Codecs to compare.')
+	parser.add_argument(
+		'-l',
+		'--levels',
+		type=int,
+		nargs='+',
+		default=[1, 6, 9],
+		help='Compression levels to compare.')
+	parser.add_argument(
+		'-r',
+		'--rows',
+		type=int,
+		default=12,
+		help='Rows in the grid.')
+	parser.add_argument(
+		'-c',
+		'--cols',
+		type=int,
+		default=18,
+		help='Columns in the grid.')
+	parser.add_argument(
+		'dpi',
+		type=int,
+		help='dpi of scans as determined by the scanner.')
+	parser.add_argument(
+		'dir_in',
+		help='Folder of source images. Example: "scan/blob"')
+	parser.set_defaults(action=bench)
+
+	args = parser.parse_args()
+	args.action(args)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,103 @@
+import argparse
+import extract
+import numpy as np
+import page_cache
+import random
+import tile
+import time
+
+
+def bench(args: argparse.Namespace):
+	page = page_cache.load_page(f'{args.dir_in}/{args.page:02}.png')
+	box_margin, ys, xs = tile.blob_geometry(
+		args.dpi, args.rows, args.cols, args.pixels, args.steps, args.page)
+	rng = random.Random(0)
+	centers = [(x, y) for y in ys for x in xs][:args.count]
+	thetas = [rng.randrange(360) for _ in centers]
+	flips = [rng.randrange(2) for _ in centers]
+
+	t0 = time.perf_counter()
+	reference = [
+		extract.cut_tile_pil(page, x, y, theta, flip, args.pixels)
+		for (x, y), theta, flip in zip(centers, thetas, flips)]
+	t1 = time.perf_counter()
+	tiles = []
+	for start in range(0, len(centers), args.batch_size):
+		end = start + args.batch_size
+		x, y = zip(*centers[start:end])
+		tiles.extend(extract.cut_tiles(
+			page, x, y, thetas[start:end], flips[start:end], args.pixels))
+	t2 = time.perf_counter()
+
+	reference = np.stack(reference)
+	tiles = np.stack(tiles)
+	diff = np.abs(reference.astype(np.int16) - tiles.astype(np.int16))
+	print(f'tiles: {len(centers)}')
+	print(f'crop-rotate-crop: {len(centers) / (t1 - t0):.1f} tiles/sec')
+	print(f'affine:           {len(centers) / (t2 - t1):.1f} tiles/sec')
+	print(f'identical pixels: {100 * np.mean(diff == 0):.4f}%')
+	print(f'max difference:   {diff.max()}')
+
+
+def main():
+
+	parser = argparse.ArgumentParser(
+		description='Compare tile extraction with crop-rotate-crop against the affine engine.')
+
+	parser.add_argument(
+		'-p',
+		'--pixels',
+		type=int,
+		default=512,
+		help='Square pixels of each tile.')
+	parser.add_argument(
+		'-s',
+		'--steps',
+		type=int,
+		default=16,
+		help='Steps, as in tile.py blob.')
+	parser.add_argument(
+		'-a',
+		'--page',
+		type=int,
+		default=0,
+		help='Page to cut tiles from.')
+	parser.add_argument(
+		'-n',
+		'--count',
+		type=int,
+		default=256,
+		help='Number of tiles to cut.')
+	parser.add_argument(
+		'-b',
+		'--batch_size',
+		type=int,
+		default=16,
+		help='Tiles per affine batch.')
+	parser.add_argument(
+		'-r',
+		'--rows',
+		type=int,
+		default=12,
+		help='Rows in the grid.')
+	parser.add_argument(
+		'-c',
+		'--cols',
+		type=int,
+		default=18,
+		help='Columns in the grid.')
+	parser.add_argument(
+		'dpi',
+		type=int,
+		help='dpi of scans as determined by the scanner.')
+	parser.add_argument(
+		'dir_in',
+		help='Folder of source images. Example: "scan/blob"')
+	parser.set_defaults(action=bench)
+
+	args = parser.parse_args()
+	args.action(args)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,131 @@
+import argparse
+import concurrent.futures
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import tfrecord
+import time
+
+
+def write_shards(img_paths, dir_out, shards, shard_codec, compression):
+	# Shards as written by tfrecord.py --global_shards.
+	os.makedirs(dir_out)
+	with concurrent.futures.ProcessPoolExecutor() as executor:
+		futures = [
+			executor.submit(
+				tfrecord.global_worker,
+				img_paths[shard::shards],
+				dir_out,
+				f'sh{shard:05d}-of-{shards:05d}',
+				False,
+				False,
+				shard_codec,
+				compression) for shard in range(shards)]
+		for future in concurrent.futures.as_completed(futures):
+			future.result()
+
+
+def read_rate(dir_in, readers, batch_size, epochs):
+	# Images per second through the whole input pipeline: interleave, parse, decode,
+	# batch and prefetch. The first epoch warms up tf.data and the page cache, and isn't timed.
+	import tensorflow as tf
+	dataset = tfrecord.dataset(dir_in, readers).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+	for batch in dataset:
+		pass
+	images = 0
+	t0 = time.perf_counter()
+	for epoch in range(epochs):
+		for batch in dataset:
+			images += batch.shape[0]
+	return images / (time.perf_counter() - t0)
+
+
+def bench(args: argparse.Namespace):
+	pages = range(len(os.listdir(args.dir_in)))
+	img_paths = []
+	for page in pages:
+		img_paths.extend(tfrecord.tile_paths(args.dir_in, page, False))
+	img_paths = img_paths[:args.count]
+	print(f'{len(img_paths)} tiles in {args.readers} shards')
+	print(f'{"codec":<8}{"compression":<14}{"images/s":>12}{"MB":>10}')
+
+	dir_tmp = tempfile.mkdtemp(dir=args.dir_tmp)
+	try:
+		for shard_codec in args.codecs:
+			for compression in args.compression:
+				dir_out = os.path.join(dir_tmp, f'{shard_codec}-{compression}')
+				write_shards(
+					img_paths,
+					dir_out,
+					args.readers,
+					shard_codec,
+					None if compression == 'none' else compression)
+				size = sum(path.stat().st_size for path in Path(dir_out).glob('*.tfrecord'))
+				rate = read_rate(dir_out, args.readers, args.batch_size, args.epochs)
+				print(f'{shard_codec:<8}{compression:<14}{rate:>12.1f}{size / 1e6:>10.1f}')
+	finally:
+		shutil.rmtree(dir_tmp)
+
+
+def main():
+
+	parser = argparse.ArgumentParser(
+		description='Measure how fast tiles can be read from shards, for each way of storing them.')
+
+	parser.add_argument(
+		'-k',
+		'--codecs',
+		type=str,
+		nargs='+',
+		choices=['png', 'raw'],
+		default=['png', 'raw'],
+		help='How images are stored in the shards, as in tfrecord.py.')
+	parser.add_argument(
+		'-z',
+		'--compression',
+		type=str,
+		nargs='+',
+		choices=['none', 'GZIP', 'ZLIB'],
+		default=['none', 'GZIP', 'ZLIB'],
+		help='Compression of the shards, as in tfrecord.py.')
+	parser.add_argument(
+		'-n',
+		'--count',
+		type=int,
+		default=None,
+		help='Use at most this many tiles. All of them by default.')
+	parser.add_argument(
+		'--readers',
+		type=int,
+		default=8,
+		help='Number of shards, which are all read in parallel.')
+	parser.add_argument(
+		'-b',
+		'--batch_size',
+		type=int,
+		default=64,
+		help='Batch size of the reader.')
+	parser.add_argument(
+		'-e',
+		'--epochs',
+		type=int,
+		default=3,
+		help='Timed passes over the shards, after one untimed pass.')
+	parser.add_argument(
+		'-t',
+		'--dir_tmp',
+		type=str,
+		default=None,
+		help='Where the shards are written while testing. The system temporary folder by default.')
+	parser.add_argument(
+		'dir_in',
+		help='Folder of tiles, as in tfrecord.py. Example: "tile/blob"')
+	parser.set_defaults(action=bench)
+
+	args = parser.parse_args()
+	args.action(args)
+
+
+if __name__ == '__main__':
+	main()
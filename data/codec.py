@@ -0,0 +1,75 @@
+import io
+import numpy as np
+import os
+from PIL import Image
+import struct
+
+# Tiles can be saved in one of these formats.
+# png: Pillow's PNG, with compress_level from 0 (fastest) to 9 (smallest). 6 is Pillow's default.
+# webp: lossless WebP, with compress_level scaled to WebP's method from 0 to 6.
+# raw: uncompressed uint8 array in .npy format, which costs nothing to encode or decode.
+EXTENSIONS = {
+	'png': '.png',
+	'webp': '.webp',
+	'raw': '.npy',
+}
+
+
+def encode(img, codec='png', compress_level=6):
+	# img is a PIL image. Returns the encoded file contents.
+	buffer = io.BytesIO()
+	if codec == 'png':
+		img.save(buffer, format='PNG', compress_level=compress_level)
+	elif codec == 'webp':
+		img.save(buffer, format='WEBP', lossless=True, method=round(compress_level * 6 / 9))
+	elif codec == 'raw':
+		np.save(buffer, np.asarray(img))
+	else:
+		raise ValueError(f'Unknown codec: {codec}')
+	return buffer.getvalue()
+
+
+def to_array(img):
+	# WebP has no grayscale mode, so grayscale tiles come back as RGB.
+	# They are returned to a single channel.
+	array = np.asarray(img)
+	if img.format == 'WEBP' and array.ndim == 3:
+		if (array[..., 0] == array[..., 1]).all() and (array[..., 1] == array[..., 2]).all():
+			return array[..., 0]
+	return array
+
+
+def decode(data, codec='png'):
+	# Returns the tile as a uint8 array.
+	if codec == 'raw':
+		return np.load(io.BytesIO(data))
+	return to_array(Image.open(io.BytesIO(data)))
+
+
+def save(img, path, codec='png', compress_level=6):
+	# path is given without an extension, which is added according to codec.
+	with open(path + EXTENSIONS[codec], 'wb') as f:
+		f.write(encode(img, codec, compress_level))
+
+
+def load(path):
+	# The codec is determined by the file extension.
+	extension = os.path.splitext(path)[1]
+	if extension == '.npy':
+		return np.load(path)
+	with Image.open(path) as img:
+		return to_array(img)
+
+
+def is_tile(file):
+	return os.path.splitext(file)[1] in EXTENSIONS.values()
+
+
+def png_header(data):
+	# Reads width, height, bit depth and color type from the IHDR chunk,
+	# which always comes first after the 8 byte signature. Returns None if data isn't a PNG.
+	# Color type 0 is grayscale, 2 is RGB, 3 is palette, 4 is gray and alpha, 6 is RGBA.
+	if data[:8] != b'\x89PNG\r\n\x1a\n' or data[12:16] != b'IHDR':
+		return None
+	width, height, bit_depth, color_type = struct.unpack('>IIBB', data[16:26])
+	return width, height, bit_depth, color_type
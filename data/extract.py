@@ -0,0 +1,87 @@
+import math
+import numpy as np
+import page_cache
+from PIL import Image
+
+
+def cut_tile_pil(page, x, y, theta, flip, pixels):
+	# Reference path: crop a scope, rotate it, then crop the tile from its center.
+	box_margin = math.sqrt(pixels**2 + pixels**2) / 2
+	scope = page_cache.crop(page, (x - box_margin, y - box_margin, x + box_margin, y + box_margin))
+	scope = scope.rotate(theta)
+	tx = scope.width / 2
+	ty = scope.height / 2
+	tile = scope.crop((tx - pixels / 2, ty - pixels / 2, tx + pixels / 2, ty + pixels / 2))
+	tile = np.asarray(tile)
+	if flip:
+		tile = tile[:, ::-1]
+	return tile
+
+
+def affine_matrices(xs, ys, thetas, flips, pixels):
+	# Inverse-affine matrices that map each tile pixel straight to the page.
+	# Rotation, flip and crop are combined into one transform.
+	# The sample points are the same as cut_tile_pil, that is, Pillow's rotate
+	# about the center of the scope, followed by a crop of the tile from its center.
+	xs = np.asarray(xs, dtype=np.float64)
+	ys = np.asarray(ys, dtype=np.float64)
+	box_margin = math.sqrt(pixels**2 + pixels**2) / 2
+
+	# Scope placement, rounded the same way as Image.crop.
+	left = np.round(xs - box_margin)
+	top = np.round(ys - box_margin)
+	width = np.round(xs + box_margin) - left
+	height = np.round(ys + box_margin) - top
+
+	# Tile origin relative to the center of the scope.
+	ox = np.round(width / 2 - pixels / 2) - width / 2
+	oy = np.round(height / 2 - pixels / 2) - height / 2
+
+	# A flipped tile reads its columns from right to left.
+	flips = np.asarray(flips, dtype=bool)
+	sign = np.where(flips, -1.0, 1.0)
+	ox = np.where(flips, ox + pixels, ox)
+
+	angle = -np.radians(np.asarray(thetas, dtype=np.float64) % 360)
+	cos = np.round(np.cos(angle), 15)
+	sin = np.round(np.sin(angle), 15)
+	return np.stack([
+		sign * cos,
+		sin,
+		cos * ox + sin * oy + width / 2 + left,
+		-sign * sin,
+		cos,
+		-sin * ox + cos * oy + height / 2 + top], axis=-1)
+
+
+def cut_tiles(page, xs, ys, thetas, flips, pixels):
+	# Cut a batch of tiles with one inverse-affine sample each, straight from the page.
+	# The scope is never allocated or resampled, and only the tile's own pixels are read.
+	# Nearest neighbour sampling, and the area outside the page is filled with 0.
+	# page is an array or an Image. An L array is wrapped without a copy, but Pillow
+	# copies RGB, RGBA and LA arrays whole, so for those pass Image.fromarray(page),
+	# made once per page.
+	img = page
+	if not isinstance(img, Image.Image):
+		img = Image.fromarray(page)
+	matrices = affine_matrices(xs, ys, thetas, flips, pixels)
+	return np.stack([
+		np.asarray(img.transform(
+			(pixels, pixels),
+			Image.Transform.AFFINE,
+			tuple(matrix),
+			Image.Resampling.NEAREST))
+		for matrix in matrices])
+
+
+def dihedral(tile):
+	# The 8 rotations and flips of a tile, in the order of the rf folders:
+	# rf00, rf01, rf02, rf03 are rotated by 0, 90, 180 and 270 degrees,
+	# and rf10, rf11, rf12, rf13 are the same after a horizontal flip.
+	# Rotation is counterclockwise, as in Image.rotate.
+	variants = []
+	for f in range(2):
+		for r in range(4):
+			variants.append(np.rot90(tile, r))
+		tile = tile[:, ::-1]
+	return variants
@@ -0,0 +1,123 @@
+import hashlib
+import numpy as np
+import os
+from pathlib import Path
+from PIL import Image
+
+Image.MAX_IMAGE_PIXELS = None
+
+# Decoded scans are kept in cache/page/ as raw uint8 .npy files.
+# Each scan has its own folder, named after its path, and each entry
+# is named after the scan's modification time, so editing or replacing
+# a scan invalidates its entries.
+CACHE_DIR = 'cache/page'
+INK_BLOCK = 8
+
+
+def cache_path(file_path, suffix=''):
+	file_path = Path(file_path).resolve()
+	key = hashlib.sha1(str(file_path).encode()).hexdigest()[:12]
+	mtime = os.stat(file_path).st_mtime_ns
+	return Path(CACHE_DIR, f'{file_path.stem}-{key}', f'{mtime}{suffix}.npy')
+
+
+def save_array(path, array):
+	# Write to a temporary file first, so concurrent workers never see a partial array.
+	os.makedirs(path.parent, exist_ok=True)
+	tmp = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+	with open(tmp, 'wb') as f:
+		np.save(f, array)
+	os.replace(tmp, path)
+	# Remove entries left over from earlier versions of the same scan.
+	mtime = path.name.split('.')[0].split('_')[0]
+	for stale in path.parent.glob('*.npy'):
+		if stale.name.split('.')[0].split('_')[0] != mtime:
+			stale.unlink(missing_ok=True)
+
+
+def load_page(file_path):
+	# Returns the scan as a read-only memory-mapped array, (h, w) for grayscale or (h, w, c).
+	# The first call decodes the PNG. Later calls, including those from other processes,
+	# map the same file and share its pixels through the OS page cache.
+	path = cache_path(file_path)
+	if not path.exists():
+		with Image.open(file_path) as img:
+			if img.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+				img = img.convert('L')
+			array = np.asarray(img)
+		save_array(path, array)
+	return np.load(path, mmap_mode='r')
+
+
+def load_preview(file_path, scale):
+	# The scan downscaled by scale, e.g. 0.25 for a quarter of the width and height.
+	# Each scale is cached separately.
+	if scale == 1:
+		return load_page(file_path)
+	path = cache_path(file_path, f'_s{scale:g}')
+	if not path.exists():
+		img = Image.fromarray(load_page(file_path))
+		size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+		save_array(path, np.asarray(img.resize(size, Image.Resampling.BOX)))
+	return np.load(path, mmap_mode='r')
+
+
+def crop(page, box):
+	# Same as Image.crop on the full scan, but only the requested region is copied.
+	# Coordinates are rounded, and the area outside the page is filled with 0.
+	left, top, right, bottom = map(int, map(round, box))
+	h, w = page.shape[:2]
+	region = np.zeros((bottom - top, right - left) + page.shape[2:], dtype=np.uint8)
+	x0, y0 = max(left, 0), max(top, 0)
+	x1, y1 = min(right, w), min(bottom, h)
+	if x0 < x1 and y0 < y1:
+		region[y0 - top:y1 - top, x0 - left:x1 - left] = page[y0:y1, x0:x1]
+	return Image.fromarray(region)
+
+
+def load_ink_table(file_path):
+	# Summed-area table of ink, where ink is 255 minus the gray value,
+	# over blocks of INK_BLOCK x INK_BLOCK pixels. Each block holds its mean ink,
+	# so table[y, x] is the total of the blocks above and left of block (x, y),
+	# and the ink in any rectangle takes 4 lookups.
+	# Tiles are hundreds of pixels across, so the blocks lose nothing that matters,
+	# and the table is a sixteenth the size of the scan instead of 8 times.
+	path = cache_path(file_path, f'_ink{INK_BLOCK}')
+	if not path.exists():
+		page = load_page(file_path)
+		h, w = page.shape[:2]
+		rows, cols = -(-h // INK_BLOCK), -(-w // INK_BLOCK)
+		block_ink = np.zeros((rows, cols), dtype=np.float32)
+		# A band of blocks at a time, so no full size copy of the page is made.
+		for i in range(rows):
+			band = page[i * INK_BLOCK:(i + 1) * INK_BLOCK]
+			if band.ndim == 3:
+				band = band[..., :3].mean(axis=-1)
+			band = 255 - np.asarray(band, dtype=np.float32)
+			# Blocks at the right edge are padded with blank paper.
+			band = np.pad(band, ((0, 0), (0, cols * INK_BLOCK - w)))
+			block_ink[i] = band.reshape(len(band), cols, INK_BLOCK).sum(axis=(0, 2))
+		block_ink /= INK_BLOCK * INK_BLOCK
+		# Up to 255 for every block, which fits in uint32 for pages of up to 16 million blocks.
+		table = np.zeros((rows + 1, cols + 1), dtype=np.uint32)
+		np.cumsum(np.cumsum(np.rint(block_ink).astype(np.uint32), axis=0), axis=1, out=table[1:, 1:])
+		save_array(path, table)
+	return np.load(path, mmap_mode='r')
+
+
+def ink_fraction(table, left, top, right, bottom):
+	# Fraction of full ink within each rectangle, clipped to the page.
+	# Coordinates are in pixels, and are rounded to the nearest block.
+	# Arguments may be arrays, to look up many rectangles at once.
+	h, w = table.shape[0] - 1, table.shape[1] - 1
+
+	def block(x, size):
+		return np.clip(np.rint(np.asarray(x) / INK_BLOCK).astype(np.int64), 0, size)
+
+	left, right = block(left, w), block(right, w)
+	top, bottom = block(top, h), block(bottom, h)
+	total = (
+		table[bottom, right].astype(np.int64) - table[top, right] - table[bottom, left] +
+		table[top, left])
+	area = np.maximum((right - left) * (bottom - top), 1)
+	return total / (255 * area)
@@ -0,0 +1,83 @@
+import json
+from pathlib import Path
+import tfrecord_io
+
+# Every shard has an index sidecar, {shard}.index.json, with the offset,
+# length and source of every record. Reading a record then takes a single seek,
+# and the size of a dataset is known without reading any shards.
+#
+# A record in a .tfrecord file is framed as:
+#   uint64 length, uint32 masked crc of length, data, uint32 masked crc of data
+# The offsets point at the start of the frame.
+#
+# The sidecar also records how images are stored, png or raw, and the compression of the shard.
+# In a GZIP or ZLIB shard, the offsets are positions in the decompressed stream,
+# so reading a record means decompressing everything before it. Random access
+# is only cheap in uncompressed shards.
+HEADER = 12
+FOOTER = 4
+
+
+def index_path(shard_path):
+	return f'{shard_path}.index.json'
+
+
+def write_index(shard_path, offsets, lengths, sources, codec='png', compression=None):
+	with open(index_path(shard_path), 'w') as f:
+		json.dump({
+			'records': len(offsets),
+			'codec': codec,
+			'compression': compression,
+			'offsets': offsets,
+			'lengths': lengths,
+			'sources': sources}, f)
+
+
+def dataset_size(dir_in):
+	# Total number of records in every shard of a folder, from the sidecars alone.
+	total = 0
+	for path in Path(dir_in).glob('*.index.json'):
+		with open(path, 'r') as f:
+			total += json.load(f)['records']
+	return total
+
+
+class ShardIndex:
+	# Random access to the records of one shard.
+	# read(i) returns the serialized tf.train.Example, which can be parsed
+	# with tf.train.Example.FromString or tf.io.parse_single_example.
+	# With codec raw, image_bytes holds the uint8 pixels, in the shape of image_shape.
+
+	def __init__(self, shard_path):
+		self.shard_path = shard_path
+		with open(index_path(shard_path), 'r') as f:
+			data = json.load(f)
+		self.offsets = data['offsets']
+		self.lengths = data['lengths']
+		self.sources = data['sources']
+		self.codec = data.get('codec', 'png')
+		self.compression = data.get('compression')
+
+	def __len__(self):
+		return len(self.offsets)
+
+	def read(self, i):
+		with tfrecord_io.open_records(self.shard_path, self.compression) as f:
+			tfrecord_io.skip(f, self.offsets[i] + HEADER)
+			return f.read(self.lengths[i])
+
+	def records(self, start=0):
+		# Reads records in order from record start, e.g. to resume part way through a shard.
+		with tfrecord_io.open_records(self.shard_path, self.compression) as f:
+			position = 0
+			for i in range(start, len(self)):
+				tfrecord_io.skip(f, self.offsets[i] + HEADER - position)
+				yield f.read(self.lengths[i])
+				position = self.offsets[i] + HEADER + self.lengths[i]
+
+	def find(self, source):
+		# Index of the record made from a given tile, or None.
+		try:
+			return self.sources.index(source)
+		except ValueError:
+			return None
@@ -1,89 +1,445 @@
 import argparse
+import codec
 import concurrent.futures
+import dedup
+import extract
+import hashlib
+import json
 import math
 import numpy as np
 import os
 from pathlib import Path
 from PIL import Image
-import tensorflow as tf
-
-os.environ["CUDA_VISIBLE_DEVICES"] = "-1"
-
-
-def image_example(image_string, image_shape):
+import random
+import re
+import shard_index
+import tfrecord_io
+
+# Shards are written with tfrecord_io, so worker processes never import TensorFlow.
+
+
+class ShardWriter:
+	# Writes examples into numbered shards, {prefix}-sh001.tfrecord, {prefix}-sh002.tfrecord, ...
+	# A new shard is started once the next image would exceed max_shard_size.
+	# If max_shard_size is None, everything goes into a single shard, {prefix}.tfrecord.
+	# Each shard gets an index sidecar with the offset, length and source of every record.
+	# codec, png or raw, says how the images were encoded, and is noted in the sidecar.
+	# compression is None, 'GZIP' or 'ZLIB'.
+
+	def __init__(self, dir_out, prefix, max_shard_size, codec='png', compression=None):
+		self.dir_out = dir_out
+		self.prefix = prefix
+		self.max_shard_size = max_shard_size
+		self.codec = codec
+		self.compression = compression
+		self.shard_i = 0
+		self.shard_size = 0
+		self.writer = None
+		self.offsets = []
+		self.lengths = []
+		self.sources = []
+		self.shards = []
+
+	def shard_path(self):
+		if self.max_shard_size is None:
+			return os.path.join(self.dir_out, f'{self.prefix}.tfrecord')
+		return os.path.join(self.dir_out, f'{self.prefix}-sh{self.shard_i:03d}.tfrecord')
+
+	def write(self, img_string, img_shape, source=None):
+		img_size = len(img_string)
+		full = self.max_shard_size is not None and self.shard_size + img_size > self.max_shard_size
+		if not self.writer or full:
+			self.close()
+			self.shard_i += 1
+			self.shard_size = 0
+			self.offset = 0
+			self.writer = tfrecord_io.TFRecordWriter(self.shard_path(), self.compression)
+			self.shards.append(os.path.basename(self.shard_path()))
+		record = tfrecord_io.image_example(img_string, img_shape)
+		self.writer.write(record)
+		self.offsets.append(self.offset)
+		self.lengths.append(len(record))
+		self.sources.append(source)
+		self.offset += shard_index.HEADER + len(record) + shard_index.FOOTER
+		self.shard_size += img_size
+
+	def close(self):
+		if self.writer:
+			self.writer.close()
+			self.writer = None
+			shard_index.write_index(
+				self.shard_path(),
+				self.offsets,
+				self.lengths,
+				self.sources,
+				self.codec,
+				self.compression)
+			self.offsets = []
+			self.lengths = []
+			self.sources = []
+
+
+def random_dihedral(image):
+	# Read time alternative to --dihedral, for use in Dataset.map.
+	# Picks one of the 8 rotations and flips of a square image at random.
+	import tensorflow as tf
+	image = tf.image.rot90(image, k=tf.random.uniform([], 0, 4, dtype=tf.int32))
+	return tf.image.random_flip_left_right(image)
+
+
+def dataset(dir_in, readers=8):
+	# tf.data reader over a folder of shards, yielding (height, width, 1) uint8 images.
+	# Shards are read in parallel, readers at a time. How the images are stored
+	# and compressed is read from the sidecars.
+	import tensorflow as tf
+	shard_paths = sorted(str(path) for path in Path(dir_in).glob('*.tfrecord'))
+	index = shard_index.ShardIndex(shard_paths[0])
 	feature = {
-		'image_bytes': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image_string])),
-		'image_shape': tf.train.Feature(int64_list=tf.train.Int64List(value=image_shape)),
+		'image_bytes': tf.io.FixedLenFeature([], tf.string),
+		'image_shape': tf.io.FixedLenFeature([3], tf.int64),
 	}
-	return tf.train.Example(features=tf.train.Features(feature=feature))
 
+	def parse(record):
+		example = tf.io.parse_single_example(record, feature)
+		if index.codec == 'raw':
+			image = tf.io.decode_raw(example['image_bytes'], tf.uint8)
+			return tf.reshape(image, example['image_shape'])
+		return tf.io.decode_png(example['image_bytes'], channels=1)
+
+	return tf.data.Dataset.from_tensor_slices(shard_paths).interleave(
+		lambda path: tf.data.TFRecordDataset(path, compression_type=index.compression or ''),
+		cycle_length=readers,
+		num_parallel_calls=tf.data.AUTOTUNE,
+		deterministic=False).map(parse, num_parallel_calls=tf.data.AUTOTUNE)
 
-def tfrecord_worker(dir_in, dir_out, max_shard_size, page):
-	if dir_out is None:
-		dir_out = f'tfrecord/{dir_in}'
-	dir_in = os.path.join(dir_in, f'p{page:02}')
 
+def tile_paths(dir_in, page, dihedral):
+	dir_in = os.path.join(dir_in, f'p{page:02}')
 	img_paths = []
 	for root, dirs, files in os.walk(dir_in):
 		for file in files:
+			# Skip anything that isn't a tile, such as the page manifest.
+			if not codec.is_tile(file):
+				continue
+			# With --dihedral, only the originals are read. Any variants
+			# already written by tile.py rotateflip are skipped.
+			if dihedral and re.search(r'_rf(0[1-3]|1[0-3])\.\w+$', file):
+				continue
 			img_paths.append(os.path.join(root, file))
-    
-	shard_i = 0
-	shard_size = 0
-	writer = None
-
-	for img_path in img_paths:
+	return sorted(img_paths)
+
+
+def load_tile(img_path):
+	# Shards hold single channel 8-bit images, so anything else is converted.
+	img = codec.load(img_path)
+	if img.dtype == np.uint16:
+		img = (img >> 8).astype(np.uint8)
+	if img.ndim == 3:
+		img = np.asarray(Image.fromarray(img).convert('L'))
+	return img
+
+
+def page_tiles(dir_in, page, dihedral, threshold):
+	# The tiles of a page, and a summary for the page. If threshold isn't None,
+	# tiles within threshold bits of an earlier tile in dedup.tile_hash are left out.
+	# Rotations and flips of a tile count as near duplicates of it.
+	img_paths = tile_paths(dir_in, page, dihedral)
+	if threshold is None:
+		return img_paths, f'p{page:02}: {len(img_paths)} tiles'
+	hashes = [dedup.tile_hash(load_tile(img_path)) for img_path in img_paths]
+	duplicate = dedup.near_duplicates(hashes, threshold)
+	kept = [img_path for img_path, d in zip(img_paths, duplicate) if not d]
+	return kept, f'p{page:02}: {len(kept)} tiles, {duplicate.sum()} near duplicates pruned'
+
+
+def tile_images(img_path, dihedral, reencode, shard_codec='png'):
+	# Yields the encoded image, shape and source of each example made from one tile.
+	# The source is the tile's path, followed by the variant with --dihedral.
+	# With shard_codec raw, the image is the uint8 pixels themselves.
+
+	# A tile that is already an 8-bit grayscale PNG is written as is.
+	# Its shape comes from the PNG header, so it is never decoded or encoded.
+	if shard_codec == 'png' and not (reencode or dihedral) and img_path.endswith('.png'):
 		with open(img_path, 'rb') as f:
-			img = Image.open(f)
-			img = np.array(img)
-			img = np.expand_dims(img, axis=-1)
-			img_shape = img.shape
-			img_tensor = tf.convert_to_tensor(img, dtype=tf.uint8)
-			img_string = tf.io.encode_png(img_tensor).numpy()
-
-		img_size = len(img_string)
-
-		if not writer or (shard_size + img_size > max_shard_size):
-			if writer:
-				writer.close()
-			shard_i += 1
-			shard_size = 0
-			shard_path = os.path.join(dir_out, f'p{page:02}-sh{shard_i:03d}.tfrecord')
-			writer = tf.io.TFRecordWriter(shard_path)
-
-		tf_example = image_example(img_string, img_shape)
-		writer.write(tf_example.SerializeToString())
+			img_string = f.read()
+		header = codec.png_header(img_string)
+		if header is not None and header[2:] == (8, 0):
+			width, height = header[:2]
+			yield img_string, (height, width, 1), img_path
+			return
+
+	img = np.expand_dims(load_tile(img_path), axis=-1)
+	# Each tile is decoded once, and its 8 rotations and flips
+	# are written straight into the shard.
+	variants = extract.dihedral(img) if dihedral else [img]
+	for i, variant in enumerate(variants):
+		if shard_codec == 'raw':
+			img_string = np.ascontiguousarray(variant).tobytes()
+		else:
+			img_string = codec.encode(Image.fromarray(variant[..., 0]))
+		source = f'{img_path}:rf{i // 4}{i % 4}' if dihedral else img_path
+		yield img_string, variant.shape, source
+
+
+def tfrecord_worker(
+		dir_in, dir_out, max_shard_size, dihedral, reencode, shard_codec, compression, threshold, page):
+	if dir_out is None:
+		dir_out = f'tfrecord/{dir_in}'
+	img_paths, summary = page_tiles(dir_in, page, dihedral, threshold)
+	writer = ShardWriter(dir_out, f'p{page:02}', max_shard_size, shard_codec, compression)
+	for img_path in img_paths:
+		for img_string, img_shape, source in tile_images(img_path, dihedral, reencode, shard_codec):
+			writer.write(img_string, img_shape, source)
+	writer.close()
+	return writer.shards, len(img_paths), summary
 
-		shard_size += img_size
 
-	if writer:
-		writer.close()
+def global_worker(img_paths, dir_out, name, dihedral, reencode, shard_codec, compression):
+	writer = ShardWriter(dir_out, name, None, shard_codec, compression)
+	for img_path in img_paths:
+		for img_string, img_shape, source in tile_images(img_path, dihedral, reencode, shard_codec):
+			writer.write(img_string, img_shape, source)
+	writer.close()
+	return writer.shards
+
+
+def stored_size(img_path, shard_codec):
+	# Size of a tile in a shard before compression, without decoding it.
+	if shard_codec == 'png':
+		return os.path.getsize(img_path)
+	if img_path.endswith('.npy'):
+		height, width = np.load(img_path, mmap_mode='r').shape[:2]
+	else:
+		with Image.open(img_path) as img:
+			width, height = img.size
+	return width * height
 
 
-def tfrecord(args: argparse.Namespace):
-	if args.dir_out is None:
-		stem = Path(args.dir_in).stem
-		dir_out = f'tfrecord/{stem}'
-	else:
-		dir_out = args.dir_out
-	os.makedirs(dir_out, exist_ok=True)
-	pages = len(os.listdir(args.dir_in))
+def page_fingerprint(dir_in, img_paths):
+	# Changes whenever a tile is added, removed or written again, without reading any tiles.
+	sha256 = hashlib.sha256()
+	for img_path in img_paths:
+		stat = os.stat(img_path)
+		sha256.update(f'{os.path.relpath(img_path, dir_in)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+	return sha256.hexdigest()
+
+
+def manifest_path(dir_out):
+	return os.path.join(dir_out, 'manifest.json')
+
+
+def remove_shards(dir_out, shards):
+	for shard in shards:
+		shard_path = os.path.join(dir_out, shard)
+		for path in [shard_path, shard_index.index_path(shard_path)]:
+			if os.path.exists(path):
+				os.remove(path)
+
+
+def load_manifest(dir_out, inputs, force):
+	# The manifest lists the pages in a set of shards, and which shards hold them.
+	# If the set was written with other options, or with --force, every shard
+	# it lists is removed and the set starts over.
+	empty = {'inputs': inputs, 'pages': {}, 'batches': {}}
+	path = manifest_path(dir_out)
+	if not os.path.exists(path):
+		return empty
+	with open(path, 'r') as json_file:
+		manifest = json.load(json_file)
+	if manifest['inputs'] == inputs and not force:
+		return manifest
+	print('Writing every shard again')
+	for page in manifest['pages'].values():
+		remove_shards(dir_out, page.get('shards', []))
+	for shards in manifest['batches'].values():
+		remove_shards(dir_out, shards)
+	return empty
+
+
+def save_manifest(dir_out, manifest):
+	# Written to a temporary file first, so an interrupted run never leaves half a manifest.
+	path = manifest_path(dir_out)
+	with open(f'{path}.tmp', 'w') as json_file:
+		json.dump(manifest, json_file)
+	os.replace(f'{path}.tmp', path)
+
+
+def page_shards(args, dir_out, manifest, fingerprints, stale):
+	# Each page has its own shards, so only new and changed pages are written.
+	for name in stale:
+		remove_shards(dir_out, manifest['pages'].pop(name)['shards'])
+	# Saved now, so the manifest never lists shards that were removed.
+	if stale:
+		save_manifest(dir_out, manifest)
+	pages = []
+	for page, name in enumerate(fingerprints):
+		if name in manifest['pages']:
+			print(f'{name}: unchanged, skipped')
+			continue
+		# Shards left over from a run that was interrupted before the page was done.
+		remove_shards(dir_out, [shard.name for shard in Path(dir_out).glob(f'{name}-sh*.tfrecord')])
+		pages.append(page)
 
 	with concurrent.futures.ProcessPoolExecutor() as executor:
 		future_to_item = {
 			executor.submit(
-				tfrecord_worker, 
+				tfrecord_worker,
 				args.dir_in,
 				dir_out,
 				args.max_shard_size,
-				page): page for page in range(pages)}
+				args.dihedral,
+				args.reencode,
+				args.codec,
+				args.compression,
+				args.dedup,
+				page): page for page in pages}
 		for future in concurrent.futures.as_completed(future_to_item):
 			item = future_to_item[future]
 			try:
-				result = future.result()
-				print(result)
+				shards, tiles, summary = future.result()
 			except Exception as exc:
 				print(exc)
+				continue
+			# The manifest is updated as each page is done, so an interrupted run
+			# only writes the unfinished pages again.
+			name = f'p{item:02}'
+			manifest['pages'][name] = {
+				'fingerprint': fingerprints[name],
+				'tiles': tiles,
+				'shards': shards}
+			save_manifest(dir_out, manifest)
+			print(summary)
+
+
+def global_shards(args, dir_out, manifest, fingerprints, stale):
+	# Tiles from every page are shuffled together, and dealt out to the shards in turn.
+	# Every shard gets the same number of tiles, give or take one, from all over the dataset.
+	#
+	# Each run that adds pages writes a new batch of shards, b000, b001, ..., shuffled among
+	# themselves, and leaves the earlier batches as they are. A batch that holds a page
+	# that changed is written again, together with the new pages.
+	stale_batches = {manifest['pages'][name]['batch'] for name in stale}
+	for batch in stale_batches:
+		remove_shards(dir_out, manifest['batches'].pop(batch))
+	for name, page in list(manifest['pages'].items()):
+		if page['batch'] in stale_batches:
+			del manifest['pages'][name]
+	# Saved now, so the manifest never lists shards that were removed.
+	if stale:
+		save_manifest(dir_out, manifest)
+	pages = [page for page, name in enumerate(fingerprints) if name not in manifest['pages']]
+	if len(pages) < len(fingerprints):
+		print(f'{len(fingerprints) - len(pages)} pages unchanged, skipped')
+	if not pages:
+		return
+	batch = f'b{max((int(b[1:]) + 1 for b in manifest["batches"]), default=0):03d}'
+
+	img_paths = []
+	page_counts = {}
+	with concurrent.futures.ProcessPoolExecutor() as executor:
+		future_to_item = {
+			executor.submit(
+				page_tiles,
+				args.dir_in,
+				page,
+				args.dihedral,
+				args.dedup): page for page in pages}
+		for future in concurrent.futures.as_completed(future_to_item):
+			item = future_to_item[future]
+			try:
+				page_paths, summary = future.result()
+				img_paths.extend(page_paths)
+				page_counts[item] = len(page_paths)
+				print(summary)
+			except Exception as exc:
+				print(exc)
+	if len(page_counts) < len(pages):
+		return
+	# Pages finish in any order, so the paths are sorted before the shuffle.
+	img_paths.sort()
+	random.Random(args.seed).shuffle(img_paths)
+
+	# The number of shards in the first batch is a multiple of the number of parallel readers,
+	# so every reader gets the same share. Later batches are usually a few pages,
+	# and are only split by size, so they don't add a reader's worth of tiny shards.
+	shards = args.shards
+	if shards is None:
+		total_size = sum(stored_size(img_path, args.codec) for img_path in img_paths)
+		if args.dihedral:
+			total_size *= 8
+		shards = max(1, math.ceil(total_size / args.max_shard_size))
+	if not manifest['batches']:
+		shards = math.ceil(shards / args.readers) * args.readers
+	print(f'{batch}: {len(img_paths)} tiles in {shards} shards')
+
+	batch_shards = []
+	failed = False
+	with concurrent.futures.ProcessPoolExecutor() as executor:
+		future_to_item = {
+			executor.submit(
+				global_worker,
+				img_paths[shard::shards],
+				dir_out,
+				f'{batch}-sh{shard:05d}-of-{shards:05d}',
+				args.dihedral,
+				args.reencode,
+				args.codec,
+				args.compression): shard for shard in range(shards)}
+		for future in concurrent.futures.as_completed(future_to_item):
+			item = future_to_item[future]
+			try:
+				batch_shards.extend(future.result())
+			except Exception as exc:
+				print(exc)
+				failed = True
+
+	# The batch is only added to the manifest once all of it is written,
+	# so a batch that failed part way is written again on the next run.
+	if failed:
+		remove_shards(dir_out, batch_shards)
+		return
+	manifest['batches'][batch] = sorted(batch_shards)
+	for page in pages:
+		name = f'p{page:02}'
+		manifest['pages'][name] = {
+			'fingerprint': fingerprints[name],
+			'tiles': page_counts[page],
+			'batch': batch}
+	save_manifest(dir_out, manifest)
+
+
+def tfrecord(args: argparse.Namespace):
+	if args.dir_out is None:
+		stem = Path(args.dir_in).stem
+		dir_out = f'tfrecord/{stem}'
+	else:
+		dir_out = args.dir_out
+	os.makedirs(dir_out, exist_ok=True)
+	pages = range(len(os.listdir(args.dir_in)))
+
+	# Everything that changes what goes into the shards. Shard sizes, and the shuffle
+	# of new batches, only change how records are laid out, so they aren't compared.
+	inputs = {
+		'dir_in': os.path.abspath(args.dir_in),
+		'codec': args.codec,
+		'compression': args.compression,
+		'dihedral': args.dihedral,
+		'reencode': args.reencode,
+		'dedup': args.dedup,
+		'global_shards': args.global_shards}
+	manifest = load_manifest(dir_out, inputs, args.force)
+	fingerprints = {
+		f'p{page:02}': page_fingerprint(args.dir_in, tile_paths(args.dir_in, page, args.dihedral))
+		for page in pages}
+	# Pages whose tiles changed, or that are gone, are written again or removed.
+	stale = [
+		name for name, page in manifest['pages'].items()
+		if fingerprints.get(name) != page['fingerprint']]
+
+	if args.global_shards:
+		global_shards(args, dir_out, manifest, fingerprints, stale)
+	else:
+		page_shards(args, dir_out, manifest, fingerprints, stale)
 
 
 def main():
@@ -103,6 +459,62 @@ def main():
 		type=str,
 		default=None,
 		help='Output folder. If not specified, output is placed in tfrecord/.')
+	parser.add_argument(
+		'-d',
+		'--dihedral',
+		action='store_true',
+		help='Write all 8 rotations and flips of each tile. Only the originals need to be on disk.')
+	parser.add_argument(
+		'-r',
+		'--reencode',
+		action='store_true',
+		help='Decode and encode every tile again. Otherwise 8-bit grayscale .png tiles are copied as they are.')
+	parser.add_argument(
+		'-k',
+		'--codec',
+		type=str,
+		choices=['png', 'raw'],
+		default='png',
+		help='How images are stored in the shards. raw stores the uint8 pixels, which need no decoding while training, but take more space.')
+	parser.add_argument(
+		'-z',
+		'--compression',
+		type=str,
+		choices=['GZIP', 'ZLIB'],
+		default=None,
+		help='Compress the shards. Mostly useful with --codec=raw.')
+	parser.add_argument(
+		'-u',
+		'--dedup',
+		type=int,
+		default=None,
+		help=f'Leave out tiles that differ in at most this many of {dedup.BITS} bits of a rotation and flip invariant hash from an earlier tile on the same page. 8 is a good start.')
+	parser.add_argument(
+		'-g',
+		'--global_shards',
+		action='store_true',
+		help='Shuffle tiles from all pages together into shards of equal size, instead of sharding each page.')
+	parser.add_argument(
+		'-n',
+		'--shards',
+		type=int,
+		default=None,
+		help='Number of shards with --global_shards. If not specified, it follows from --max_shard_size.')
+	parser.add_argument(
+		'--readers',
+		type=int,
+		default=8,
+		help='Number of files read in parallel during training. With --global_shards, the number of shards is a multiple of this.')
+	parser.add_argument(
+		'--seed',
+		type=int,
+		default=0,
+		help='Seed for the shuffle with --global_shards.')
+	parser.add_argument(
+		'-f',
+		'--force',
+		action='store_true',
+		help='Write every shard again, even if the manifest shows nothing changed.')
 	parser.add_argument(
 		'dir_in',
 		help='Folder of source images. Example: "tile/web"')
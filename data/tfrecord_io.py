@@ -0,0 +1,255 @@
+import argparse
+import io
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+# Writes .tfrecord files without TensorFlow.
+# Importing TensorFlow takes seconds and hundreds of MB in every worker process,
+# only to frame records and build tf.train.Example protos, which are both simple formats.
+#
+# A record is framed as:
+#   uint64 length, uint32 masked crc of length, data, uint32 masked crc of data
+# with little endian integers and the CRC-32C (Castagnoli) checksum.
+#
+# With GZIP or ZLIB compression, the whole stream of framed records is compressed,
+# as by tf.io.TFRecordWriter with tf.io.TFRecordOptions(compression_type=...).
+COMPRESSION = [None, 'GZIP', 'ZLIB']
+WBITS = {'GZIP': 16 + zlib.MAX_WBITS, 'ZLIB': zlib.MAX_WBITS}
+
+try:
+	# The crc32c package is a C extension, and is much faster than the table below.
+	from crc32c import crc32c
+except ImportError:
+	crc32c = None
+
+if crc32c is None:
+	_TABLE = []
+	for i in range(256):
+		crc = i
+		for _ in range(8):
+			crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+		_TABLE.append(crc)
+
+	def crc32c(data):
+		crc = 0xFFFFFFFF
+		for byte in data:
+			crc = _TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+		return crc ^ 0xFFFFFFFF
+
+
+def masked_crc(data):
+	crc = crc32c(data)
+	return (((crc >> 15) | (crc << 17)) + 0xA282EAD8) & 0xFFFFFFFF
+
+
+def frame(record):
+	length = struct.pack('<Q', len(record))
+	return b''.join([
+		length,
+		struct.pack('<I', masked_crc(length)),
+		record,
+		struct.pack('<I', masked_crc(record))])
+
+
+def _varint(value):
+	# Negative int64 values are written as 10 byte two's complement, as protobuf does.
+	value &= 0xFFFFFFFFFFFFFFFF
+	out = bytearray()
+	while value > 0x7F:
+		out.append((value & 0x7F) | 0x80)
+		value >>= 7
+	out.append(value)
+	return bytes(out)
+
+
+def _field(number, data):
+	# Length delimited field, wire type 2.
+	return _varint(number << 3 | 2) + _varint(len(data)) + data
+
+
+def _feature(value):
+	# Feature is a oneof of bytes_list = 1, float_list = 2 and int64_list = 3.
+	# Each list holds its values in field 1, and int64 values are packed.
+	if isinstance(value, bytes):
+		return _field(1, _field(1, value))
+	return _field(3, _field(1, b''.join(_varint(int(v)) for v in value)))
+
+
+def image_example(image_string, image_shape):
+	# Serialized tf.train.Example with the same features as the TensorFlow version:
+	# image_bytes, a bytes feature, and image_shape, an int64 list.
+	# Features is a map of string to Feature in field 1, and each map entry
+	# has its key in field 1 and the Feature in field 2.
+	feature = {
+		'image_bytes': image_string,
+		'image_shape': image_shape,
+	}
+	features = b''.join(
+		_field(1, _field(1, key.encode()) + _field(2, _feature(value)))
+		for key, value in feature.items())
+	return _field(1, features)
+
+
+class TFRecordWriter:
+	# Same use as tf.io.TFRecordWriter.
+	# compression is None, 'GZIP' or 'ZLIB', with a compress_level from 0 to 9.
+
+	def __init__(self, path, compression=None, compress_level=6):
+		self.file = open(path, 'wb')
+		self.compressor = None
+		if compression is not None:
+			self.compressor = zlib.compressobj(compress_level, zlib.DEFLATED, WBITS[compression])
+
+	def write(self, record):
+		data = frame(record)
+		if self.compressor:
+			data = self.compressor.compress(data)
+		self.file.write(data)
+
+	def close(self):
+		if self.compressor:
+			self.file.write(self.compressor.flush())
+		self.file.close()
+
+
+class _Decompressor(io.RawIOBase):
+	# Reads a GZIP or ZLIB compressed file as a stream of plain bytes.
+
+	def __init__(self, path, compression):
+		self.file = open(path, 'rb')
+		self.decompressor = zlib.decompressobj(WBITS[compression])
+		self.buffer = b''
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		while not self.buffer and not self.decompressor.eof:
+			chunk = self.file.read(1024 * 1024)
+			if not chunk:
+				break
+			self.buffer = self.decompressor.decompress(chunk)
+		n = min(len(b), len(self.buffer))
+		b[:n] = self.buffer[:n]
+		self.buffer = self.buffer[n:]
+		return n
+
+	def close(self):
+		self.file.close()
+		super().close()
+
+
+def open_records(path, compression=None):
+	# The framed records of a .tfrecord file, decompressed if need be.
+	# A compressed stream can't seek, so skip ahead with skip().
+	if compression is None:
+		return open(path, 'rb')
+	return io.BufferedReader(_Decompressor(path, compression), 1024 * 1024)
+
+
+def skip(f, n):
+	if f.seekable():
+		f.seek(n, os.SEEK_CUR)
+		return
+	while n > 0:
+		n -= len(f.read(min(n, 1024 * 1024)))
+
+
+def records(path, compression=None):
+	# Reads the records of a .tfrecord file in order, and checks every checksum.
+	with open_records(path, compression) as f:
+		while True:
+			header = f.read(12)
+			if not header:
+				return
+			length, length_crc = struct.unpack('<QI', header)
+			if masked_crc(header[:8]) != length_crc:
+				raise ValueError(f'Corrupt record length in {path}')
+			record = f.read(length)
+			(record_crc,) = struct.unpack('<I', f.read(4))
+			if masked_crc(record) != record_crc:
+				raise ValueError(f'Corrupt record in {path}')
+			yield record
+
+
+def check(args: argparse.Namespace):
+	# Writes records with this module and reads them back with TensorFlow,
+	# to make sure the two stay compatible.
+	import codec
+	import numpy as np
+	from PIL import Image
+	import shard_index
+	import tensorflow as tf
+
+	assert crc32c(b'123456789') == 0xE3069283
+
+	rng = np.random.default_rng(0)
+	images = []
+	for i in range(args.count):
+		pixels = int(rng.choice([4, 64, 512]))
+		images.append(rng.integers(0, 256, (pixels, pixels), dtype=np.uint8))
+
+	feature = {
+		'image_bytes': tf.io.FixedLenFeature([], tf.string),
+		'image_shape': tf.io.FixedLenFeature([3], tf.int64),
+	}
+	dir_out = tempfile.mkdtemp()
+	try:
+		for compression in COMPRESSION:
+			path = os.path.join(dir_out, f'check-{compression}.tfrecord')
+			writer = TFRecordWriter(path, compression)
+			offsets = []
+			lengths = []
+			offset = 0
+			for img in images:
+				record = image_example(codec.encode(Image.fromarray(img)), (*img.shape, 1))
+				# The serialized Example matches TensorFlow's byte for byte.
+				parsed = tf.train.Example.FromString(record)
+				assert parsed.SerializeToString(deterministic=True) == record
+				writer.write(record)
+				offsets.append(offset)
+				lengths.append(len(record))
+				offset += shard_index.HEADER + len(record) + shard_index.FOOTER
+			writer.close()
+			shard_index.write_index(
+				path, offsets, lengths, [None] * len(images), compression=compression)
+
+			index = shard_index.ShardIndex(path)
+			dataset = tf.data.TFRecordDataset(path, compression_type=compression or '')
+			count = 0
+			for i, (record, img) in enumerate(zip(dataset, images)):
+				example = tf.io.parse_single_example(record, feature)
+				decoded = tf.io.decode_png(example['image_bytes']).numpy()
+				assert tuple(example['image_shape'].numpy()) == (*img.shape, 1)
+				assert np.array_equal(decoded[..., 0], img)
+				assert index.read(i) == record.numpy()
+				count += 1
+			assert count == len(images)
+			assert list(records(path, compression)) == [record.numpy() for record in dataset]
+			print(f'{compression or "uncompressed"}: {count} records read back by TensorFlow')
+	finally:
+		shutil.rmtree(dir_out)
+
+
+def main():
+
+	parser = argparse.ArgumentParser(
+		description='Check that .tfrecord files written without TensorFlow can be read by TensorFlow.')
+
+	parser.add_argument(
+		'-n',
+		'--count',
+		type=int,
+		default=64,
+		help='Number of records to write and read back.')
+	parser.set_defaults(action=check)
+
+	args = parser.parse_args()
+	args.action(args)
+
+
+if __name__ == '__main__':
+	main()
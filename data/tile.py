@@ -1,17 +1,38 @@
 import argparse
+import codec
 import concurrent.futures
+import extract
+import hashlib
 import json
 import math
+import numpy as np
 import os
+import page_cache
 from PIL import Image, ImageDraw, ImageTk
 from pathlib import Path
 import random
+import shutil
 import time
 import tkinter as tk
 
 Image.MAX_IMAGE_PIXELS = None
 
 
+def grid_worker(file_path, file_out, rows, cols, unit, page_margin_x, page_margin_y, scale):
+	# Drawn on a downscaled copy of the scan, so the lines are scaled too.
+	img = Image.fromarray(page_cache.load_preview(file_path, scale)).convert('RGB')
+	draw = ImageDraw.Draw(img)
+	w, h = img.size
+	width = max(1, round(3 * scale))
+	for row in range(rows + 1):
+		y = (page_margin_y + row * unit) * scale
+		draw.line([(0, y), (w, y)], fill=(255,0,0), width=width)
+	for col in range(cols + 1):
+		x = (page_margin_x + col * unit) * scale
+		draw.line([(x, 0), (x, h)], fill=(255,0,0), width=width)
+	img.save(file_out)
+
+
 def grid(args: argparse.Namespace):
 	stem = Path(args.dir_in).stem
 	dir_out = f'grid/{stem}'
@@ -27,24 +48,57 @@ def grid(args: argparse.Namespace):
 		files = [f'{args.page}.png']
 	else:
 		files = os.listdir(args.dir_in)
+
+	# grid.json records what each grid image was drawn with.
+	# Only pages whose adjustment, scan or settings changed are drawn again,
+	# unless the page is given with --page.
+	state_path = Path(dir_out, 'grid.json')
+	state = {}
+	if state_path.exists():
+		with open(state_path, 'r') as json_file:
+			state = json.load(json_file)
+	jobs = {}
 	for file in files:
 		file_path = Path(args.dir_in, file)
 		page = file_path.stem
-		page_margin_x = adj_x[page] * unit
-		page_margin_y = adj_y[page] * unit
-		img = Image.open(file_path).convert('RGB')
-		draw = ImageDraw.Draw(img)
-		w, h = img.size
-		for row in range(rows + 1):
-			y = page_margin_y + row * unit
-			draw.line([(0, y), (w, y)], fill=(255,0,0), width=3)
-		for col in range(cols + 1):
-			x = page_margin_x + col * unit
-			draw.line([(x, 0), (x, h)], fill=(255,0,0), width=3)
-		img.save(Path(dir_out, file_path.name))
-
-
-def blob_worker(dir_in, dir_out, dpi, rw, cl, pixels, steps, page):
+		entry = {
+			'adj_x': adj_x[page],
+			'adj_y': adj_y[page],
+			'mtime': os.stat(file_path).st_mtime_ns,
+			'dpi': args.dpi,
+			'rows': rows,
+			'cols': cols,
+			'scale': args.scale}
+		file_out = Path(dir_out, file_path.name)
+		if args.page is None and state.get(page) == entry and file_out.exists():
+			continue
+		jobs[page] = (file_path, file_out, entry)
+
+	with concurrent.futures.ProcessPoolExecutor() as executor:
+		future_to_item = {
+			executor.submit(
+				grid_worker,
+				file_path,
+				file_out,
+				rows,
+				cols,
+				unit,
+				entry['adj_x'] * unit,
+				entry['adj_y'] * unit,
+				args.scale): page for page, (file_path, file_out, entry) in jobs.items()}
+		for future in concurrent.futures.as_completed(future_to_item):
+			page = future_to_item[future]
+			try:
+				future.result()
+				state[page] = jobs[page][2]
+				print(f'{page}: updated')
+			except Exception as exc:
+				print(exc)
+	with open(state_path, 'w') as json_file:
+		json.dump(state, json_file, indent=4, sort_keys=True)
+
+
+def blob_geometry(dpi, rw, cl, pixels, steps, page):
 
 	# The page is cropped into a box.
 	# The box is a 18 x 12 grid.
@@ -76,57 +130,139 @@ def blob_worker(dir_in, dir_out, dpi, rw, cl, pixels, steps, page):
 	box_top = int(page_margin_y + box_margin)
 	box_bottom = int(page_margin_y + box[1] - box_margin)
 
+	# Center coordinates of every row and column.
+	# Row r and column c are always the r-th and c-th values,
+	# no matter how the page is split between workers.
+	ys = range(box_top, box_bottom, step)
+	xs = range(box_left, box_right, step)
+	return box_margin, ys, xs
+
+
+def blob_angles(seed, page, row, cols):
+	# Rotate and flip randomly.
+	# Each row draws its angles from its own generator,
+	# so the result doesn't depend on how rows are split between workers.
+	rng = random.Random(f'{seed}-{page}-{row}')
+	thetas = []
+	flips = []
+	for col in range(cols):
+		thetas.append(rng.randrange(360))
+		flips.append(rng.randrange(2))
+	return thetas, flips
+
+
+def warm_page(dir_in, min_ink, page):
+	# Decodes a scan into the page cache, and builds its ink table if blank tiles are rejected,
+	# so the workers that share the page's bands only map the cached arrays.
+	page_cache.load_page(f'{dir_in}/{page:02}.png')
+	if min_ink > 0:
+		page_cache.load_ink_table(f'{dir_in}/{page:02}.png')
+
+
+def blob_worker(dir_in, dirs_out, dpi, rw, cl, levels, steps, emit, tile_codec, compress_level, max_shard_size, seed, batch_size, min_ink, page, row_start, row_end):
+
+	# Tiles are cut at the highest resolution, levels[0].
+	# Every other level is downsampled from the same tile, and saved to its own folder in dirs_out.
+	pixels = levels[0]
+	box_margin, ys, xs = blob_geometry(dpi, rw, cl, pixels, steps, page)
+
 	# Prepare directory tree for saving images.
 	# Adjust zero padding as needed.
-	rows = math.ceil((box_bottom - box_top) / step)
-	#columns = math.ceil((box_right - box_left) / step)
-
-	if dir_out is None:
-		stem = Path(dir_in).stem
-		dir_out = f'tile/{stem}'
-	for row in range(rows):
-		os.makedirs(f'{dir_out}/p{page:02}/r{row:03}', exist_ok=True)
-	img = Image.open(f'{dir_in}/{page:02}.png')
-	row = 0
-
-	# Iterate through every row and column.
-	for y in range(box_top, box_bottom, step):
-		col = 0
-		for x in range(box_left, box_right, step):
-			# Crop an area large enough for the tile to rotate within.
-			left = x - box_margin
-			right = x + box_margin
-			top = y - box_margin
-			bottom = y + box_margin
-			scope = img.crop((left, top, right, bottom))
-
-			# Rotate and flip randomly.
-			theta = random.randrange(360)
-			scope = scope.rotate(theta)
-			if random.randrange(1) == 1:
-				scope = scope.transpose.TRANSPOSE
-
-			# Cut the tile.
-			tx = scope.width / 2
-			ty = scope.height / 2
-			left = tx - (pixels / 2)
-			right = tx + (pixels / 2)
-			top = ty - (pixels / 2)
-			bottom = ty + (pixels / 2)
-			tile = scope.crop((left, top, right, bottom))
+	if emit == 'tfrecord':
+		# Tiles are encoded in memory and streamed into shards,
+		# so no intermediate PNG files are written.
+		import tfrecord
+		writers = []
+		for dir_out in dirs_out:
+			os.makedirs(dir_out, exist_ok=True)
+			writers.append(tfrecord.ShardWriter(dir_out, f'p{page:02}-r{row_start:03}', max_shard_size))
+	else:
+		for dir_out in dirs_out:
+			for row in range(row_start, row_end):
+				os.makedirs(f'{dir_out}/p{page:02}/r{row:03}', exist_ok=True)
+	# The scan is decoded once into the page cache and memory-mapped.
+	# Only the pixels sampled for each tile are read.
+	img = Image.fromarray(page_cache.load_page(f'{dir_in}/{page:02}.png'))
+	# Tiles that are nearly blank are rejected before they are cut.
+	# The ink around every center is looked up in the page's summed-area table,
+	# within the square that bounds the circle the tile rotates in.
+	if min_ink > 0:
+		ink_table = page_cache.load_ink_table(f'{dir_in}/{page:02}.png')
+		ink_left = np.array(xs) - box_margin
+		ink_right = np.array(xs) + box_margin
+
+	# Iterate through every row and column in this worker's band of rows.
+	# Every tile cut is listed for the page manifest.
+	tile_list = []
+	for row in range(row_start, row_end):
+		y = ys[row]
+		thetas, flips = blob_angles(seed, page, row, len(xs))
+		cols = np.arange(len(xs))
+		if min_ink > 0:
+			ink = page_cache.ink_fraction(
+				ink_table, ink_left, y - box_margin, ink_right, y + box_margin)
+			cols = cols[ink >= min_ink]
+
+		# Tiles are cut in batches, each with a single transform from the page.
+		for start in range(0, len(cols), batch_size):
+			batch = cols[start:start + batch_size]
+			tiles = extract.cut_tiles(
+				img,
+				[xs[col] for col in batch],
+				[y] * len(batch),
+				[thetas[col] for col in batch],
+				[flips[col] for col in batch],
+				pixels)
 
 			# Save the tile.
 			# Directory is partitioned into pages.
 			# Pages are partitioned into rows.
 			# Rows each have their own folder with one image per column.
-			pagename = f'p{page:02}'
-			rowname = f'r{row:03}'
-			colname = f'c{col:03}'
-			target = (f'{dir_out}/{pagename}/{rowname}/'+
-					f'{pagename}_{rowname}_{colname}.png')
-			tile.save(target)
-			col += 1
-		row += 1
+			for col, tile in zip(batch.tolist(), tiles):
+				tile_list.append([row, col, xs[col], y, thetas[col], flips[col]])
+				tile = Image.fromarray(tile)
+				for level, res in enumerate(levels):
+					# Box filter, so each pixel is the average of the pixels it covers.
+					level_tile = tile.reduce(pixels // res) if res < pixels else tile
+					if emit == 'tfrecord':
+						level_tile = level_tile.convert('L')
+						img_string = codec.encode(level_tile, 'png', compress_level)
+						source = f'p{page:02}_r{row:03}_c{col:03}'
+						writers[level].write(img_string, (res, res, 1), source)
+					else:
+						pagename = f'p{page:02}'
+						rowname = f'r{row:03}'
+						colname = f'c{col:03}'
+						target = (f'{dirs_out[level]}/{pagename}/{rowname}/'+
+								f'{pagename}_{rowname}_{colname}')
+						codec.save(level_tile, target, tile_codec, compress_level)
+	if emit == 'tfrecord':
+		for writer in writers:
+			writer.close()
+	return tile_list
+
+
+def scan_hash(file_path):
+	sha256 = hashlib.sha256()
+	with open(file_path, 'rb') as f:
+		for block in iter(lambda: f.read(1024 * 1024), b''):
+			sha256.update(block)
+	return sha256.hexdigest()
+
+
+def manifest_path(dir_out, emit, page):
+	# The manifest lives next to the page's output.
+	if emit == 'tfrecord':
+		return f'{dir_out}/p{page:02}.json'
+	return f'{dir_out}/p{page:02}/manifest.json'
+
+
+def remove_page_output(dir_out, emit, page):
+	if emit == 'tfrecord':
+		for shard in Path(dir_out).glob(f'p{page:02}-*.tfrecord*'):
+			shard.unlink()
+	else:
+		shutil.rmtree(f'{dir_out}/p{page:02}', ignore_errors=True)
 
 
 def blob(args: argparse.Namespace):
@@ -134,28 +270,127 @@ def blob(args: argparse.Namespace):
 	# is rotated to some random angle,and is flipped randomly.
 	# The center coordinates are evenly spaced over a grid.
 	pages = len(os.listdir(args.dir_in))
-	# CPU cores share the workload. Each core gets its own page to process.
-	# max_workers is the CPU's total logical cores minus the average load.
-	max_workers = os.cpu_count() - math.ceil(os.getloadavg()[0])
-	with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+	seed = args.seed
+	if seed is None:
+		seed = random.randrange(2**32)
+	dir_out = args.dir_out
+	if dir_out is None:
+		stem = Path(args.dir_in).stem
+		dir_out = f'{args.emit}/{stem}'
+	# With several resolutions, each one gets its own folder, e.g. tile/blob_px256.
+	levels = sorted(set(args.pixels), reverse=True)
+	pixels = levels[0]
+	dirs_out = [dir_out]
+	if len(levels) > 1:
+		dirs_out = [f'{dir_out}_px{res}' for res in levels]
+
+	# Each page's manifest records everything its tiles depend on.
+	# A page is skipped if its manifest matches the current inputs,
+	# so only pages whose scan or grid adjustment changed are cut again.
+	# The seed is only compared if one is given.
+	with open('adj_xy.json', 'r') as json_file:
+		data = json.load(json_file)
+	manifests = {}
+	for page in range(pages):
+		inputs = {
+			'scan': scan_hash(f'{args.dir_in}/{page:02}.png'),
+			'adj_x': data['adj_x'][f'{page:02}'],
+			'adj_y': data['adj_y'][f'{page:02}'],
+			'dpi': args.dpi,
+			'rows': args.rows,
+			'cols': args.cols,
+			'levels': levels,
+			'steps': args.steps,
+			'min_ink': args.min_ink,
+			'emit': args.emit,
+			'codec': args.codec,
+			'compress_level': args.compress_level}
+		# Every level has its own copy of the manifest.
+		unchanged = not args.force
+		for level_dir, res in zip(dirs_out, levels):
+			path = manifest_path(level_dir, args.emit, page)
+			if not unchanged or not os.path.exists(path):
+				unchanged = False
+				break
+			with open(path, 'r') as json_file:
+				manifest = json.load(json_file)
+			unchanged = (
+				all(manifest.get(key) == value for key, value in inputs.items()) and
+				manifest.get('pixels') == res and
+				args.seed in (None, manifest['seed']))
+		if unchanged:
+			print(f'p{page:02}: unchanged, skipped')
+			continue
+		for level_dir in dirs_out:
+			remove_page_output(level_dir, args.emit, page)
+		manifests[page] = dict(inputs, seed=seed, tiles=[])
+	if manifests and args.seed is None:
+		print(f'seed: {seed}')
+
+	# Pages are split into bands of rows, so the work is shared evenly
+	# no matter how many pages there are. Each worker gets about 4 bands,
+	# which keeps every core busy until the last few bands finish.
+	page_rows = {}
+	page_tiles = {}
+	for page in manifests:
+		_, ys, xs = blob_geometry(args.dpi, args.rows, args.cols, pixels, args.steps, page)
+		page_rows[page] = len(ys)
+		page_tiles[page] = len(ys) * len(xs)
+	band = max(1, math.ceil(sum(page_rows.values()) / (args.workers * 4)))
+	chunks = [
+		(page, row_start, min(row_start + band, rows))
+		for page, rows in page_rows.items()
+		for row_start in range(0, rows, band)]
+	remaining = {page: math.ceil(rows / band) for page, rows in page_rows.items()}
+
+	with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+		# Every page is decoded once, before its bands are cut in parallel.
+		# Otherwise every worker that starts on a page with a cold cache decodes it again.
+		future_to_page = {
+			executor.submit(warm_page, args.dir_in, args.min_ink, page): page for page in manifests}
+		for future in concurrent.futures.as_completed(future_to_page):
+			try:
+				future.result()
+			except Exception as exc:
+				# The page's bands fail as well, and are reported below.
+				print(exc)
+
 		future_to_item = {
 			executor.submit(
 				blob_worker,
 				args.dir_in,
-				args.dir_out,
+				dirs_out,
 				args.dpi,
 				args.rows,
 				args.cols,
-				args.pixels,
+				levels,
 				args.steps,
-				page): page for page in range(pages)}
+				args.emit,
+				args.codec,
+				args.compress_level,
+				args.max_shard_size,
+				seed,
+				args.batch_size,
+				args.min_ink,
+				*chunk): chunk for chunk in chunks}
 		for future in concurrent.futures.as_completed(future_to_item):
-			item = future_to_item[future]
+			page = future_to_item[future][0]
 			try:
-				result = future.result()
-				print(result)
+				manifests[page]['tiles'].extend(future.result())
+				remaining[page] -= 1
 			except Exception as exc:
 				print(exc)
+				continue
+			# The manifest is only written once every band of the page is done,
+			# so a page interrupted part way through is cut again on the next run.
+			if remaining[page] == 0:
+				manifest = manifests[page]
+				manifest['tiles'].sort()
+				for level_dir, res in zip(dirs_out, levels):
+					with open(manifest_path(level_dir, args.emit, page), 'w') as json_file:
+						json.dump(dict(manifest, pixels=res), json_file)
+				rejected = page_tiles[page] - len(manifest['tiles'])
+				print(f'p{page:02}: {len(manifest["tiles"])} tiles, {rejected} blank tiles rejected')
 
 
 def specimen(args: argparse.Namespace):
@@ -164,37 +399,88 @@ def specimen(args: argparse.Namespace):
 	dir_out = f'tile/{stem}/p{args.page}/rf00'
 	os.makedirs(dir_out, exist_ok=True)
 	img_num = [0]
-	img = Image.open(input_file)
+	page = page_cache.load_page(input_file)
+	# Tiles are saved on a background thread, so clicks never wait on the disk.
+	saver = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 	# GUI
 	root = tk.Tk()
 	length = int(args.pixels * 1.5)
 	root.geometry(f'{length}x{length}')
-	# frame for canvas and scrollbar
+	# frame for canvas
 	frame = tk.Frame(root)
 	frame.pack(fill=tk.BOTH, expand=1)
 	# canvas widget displays image
-	canvas = tk.Canvas(frame)
+	canvas = tk.Canvas(frame, highlightthickness=0)
 	canvas.pack(fill=tk.BOTH, expand=1)
-	# frame inside canvas holds image
-	image_frame = tk.Frame(canvas)
-	canvas.create_window((0, 0), window=image_frame, anchor='nw')
-	# convert image to tkinter format
-	tk_img = ImageTk.PhotoImage(img)
-	# label widget to display
-	label = tk.Label(image_frame, image=tk_img)
-	label.pack()
+
+	# Only the part of the page in view is drawn.
+	# The page is kept as a pyramid, where zoom level z is 1/2**z of full size.
+	# Each level is divided into square blocks, and only the blocks that overlap
+	# the view are converted to tkinter format, so memory stays flat for any scan size.
+	block = 512
+	view = {'zoom': 0}
+	blocks = {}
+
+	def level(zoom):
+		return page_cache.load_preview(input_file, 1 / 2**zoom)
+
+	def render(event=None):
+		zoom = view['zoom']
+		img = level(zoom)
+		h, w = img.shape[:2]
+		canvas.configure(scrollregion=(0, 0, w, h))
+		x0 = int(canvas.canvasx(0))
+		y0 = int(canvas.canvasy(0))
+		x1 = min(w, x0 + canvas.winfo_width())
+		y1 = min(h, y0 + canvas.winfo_height())
+		visible = set()
+		for i in range(max(0, y0) // block, (y1 - 1) // block + 1):
+			for j in range(max(0, x0) // block, (x1 - 1) // block + 1):
+				key = (zoom, i, j)
+				visible.add(key)
+				if key not in blocks:
+					region = np.asarray(img[i*block:(i+1)*block, j*block:(j+1)*block])
+					tk_img = ImageTk.PhotoImage(Image.fromarray(region))
+					item = canvas.create_image(j * block, i * block, image=tk_img, anchor='nw')
+					blocks[key] = (tk_img, item)
+		# Blocks out of view are released.
+		for key in list(blocks):
+			if key not in visible:
+				canvas.delete(blocks.pop(key)[1])
+
+	def zoom(step):
+		new_zoom = min(max(view['zoom'] + step, 0), 4)
+		if new_zoom == view['zoom']:
+			return
+		# Keep the point at the center of the view in place.
+		factor = 2**(view['zoom'] - new_zoom)
+		cx = (canvas.canvasx(0) + canvas.winfo_width() / 2) * factor
+		cy = (canvas.canvasy(0) + canvas.winfo_height() / 2) * factor
+		view['zoom'] = new_zoom
+		h, w = level(new_zoom).shape[:2]
+		canvas.configure(scrollregion=(0, 0, w, h))
+		canvas.xview_moveto(max(0, cx - canvas.winfo_width() / 2) / w)
+		canvas.yview_moveto(max(0, cy - canvas.winfo_height() / 2) / h)
+		render()
+
 	# bind mouse click
-	label.bind(
+	# The click is converted from the view to full size coordinates.
+	canvas.bind(
 		'<Button-1>',
 		lambda event: crop(
-			event,
-			img,
+			canvas.canvasx(event.x) * 2**view['zoom'],
+			canvas.canvasy(event.y) * 2**view['zoom'],
+			page,
 			args.page,
 			args.pixels,
 			dir_out,
-			img_num
+			img_num,
+			saver,
+			args.codec,
+			args.compress_level
 		)
 	)
+	canvas.bind('<Configure>', render)
 	# arrow key scrolling
 	def on_arrow_key(event):
 		if event.keysym == 'Up':
@@ -205,47 +491,52 @@ def specimen(args: argparse.Namespace):
 		    canvas.xview_scroll(-1, 'units')
 		elif event.keysym == 'Right':
 		    canvas.xview_scroll(1, 'units')
+		render()
 	# bind arrow keys to the canvas
 	root.bind('<Up>', on_arrow_key)
 	root.bind('<Down>', on_arrow_key)
 	root.bind('<Left>', on_arrow_key)
 	root.bind('<Right>', on_arrow_key)
+	# plus and minus keys zoom in and out
+	root.bind('<plus>', lambda event: zoom(-1))
+	root.bind('<equal>', lambda event: zoom(-1))
+	root.bind('<minus>', lambda event: zoom(1))
 	# GUI event loop
 	root.mainloop()
+	saver.shutdown(wait=True)
 
 
-def crop(event, img, page, px, dir_out, img_num):
-	x, y = event.x, event.y
+def crop(x, y, img, page, px, dir_out, img_num, saver, tile_codec, compress_level):
+	x, y = round(x), round(y)
 	print(f'tile cut at ({x}, {y})')
 	left = x - (px / 2)
 	top = y - (px / 2)
 	right = x + (px / 2)
 	bottom = y + (px / 2)
-	cropped_img = img.crop((left, top, right, bottom))
-	final_img = Image.new('L', (px, px), (255))
-	paste_x = (px - cropped_img.width) // 2
-	paste_y = (px - cropped_img.height) // 2
-	final_img.paste(cropped_img, (paste_x, paste_y))
-	filename = f'p{page}_t{img_num[0]:02}_rf00.png'
-	final_img.save(os.path.join(dir_out, filename))
+	# Only the tile is copied out of the page.
+	final_img = page_cache.crop(img, (left, top, right, bottom)).convert('L')
+	filename = f'p{page}_t{img_num[0]:02}_rf00'
+	saver.submit(codec.save, final_img, os.path.join(dir_out, filename), tile_codec, compress_level)
 	img_num[0] += 1
 
 
-def rotateflip_worker(dir_in, page):
+def rotateflip_worker(dir_in, tile_codec, compress_level, page):
 	# Although the tiles could just be kept in one folder,
 	# the directory structure makes it easier to verify things went well
 	dir_in = f'{dir_in}/p{page:02}'
 	for index in ['01', '02', '03', '10', '11', '12', '13']:
 		os.makedirs(f'{dir_in}/rf{index}', exist_ok=True)
-	for tile in [f'{i:02}' for i in range(len(os.listdir(f'{dir_in}/rf00')))]:
-		source = f'{dir_in}/rf00/p{page:02}_t{tile:02}_rf00.png'
-		image = Image.open(source)
-		for f in range(2):
-			for r in range(4):
-				image = image.rotate(90)
-				target = f'{dir_in}/rf{f}{r}/p{page:02}_t{tile:02}_rf{f}{r}.png'
-				image.save(target)
-			image = image.transpose(method=Image.Transpose.FLIP_LEFT_RIGHT)
+	for file in sorted(os.listdir(f'{dir_in}/rf00')):
+		if not codec.is_tile(file):
+			continue
+		source = f'{dir_in}/rf00/{file}'
+		name = os.path.splitext(file)[0].removesuffix('_rf00')
+		image = codec.load(source)
+		# The original stays in rf00, and the other 7 variants come from the same decode.
+		for i, variant in enumerate(extract.dihedral(image)[1:], 1):
+			f, r = divmod(i, 4)
+			target = f'{dir_in}/rf{f}{r}/{name}_rf{f}{r}'
+			codec.save(Image.fromarray(variant), target, tile_codec, compress_level)
 
 
 def rotateflip(args: argparse.Namespace):
@@ -256,6 +547,8 @@ def rotateflip(args: argparse.Namespace):
 			executor.submit(
 				rotateflip_worker,
 				args.dir_in,
+				args.codec,
+				args.compress_level,
 				page): page for page in range(pages)}
 		for future in concurrent.futures.as_completed(future_to_item):
 			item = future_to_item[future]
@@ -283,7 +576,13 @@ def main():
 		'--page',
 		type=str,
 		default=None,
-		help='Specify a specific page number to update. Otherwise all pages are updated.')
+		help='Specify a specific page number to update. Otherwise all pages that changed are updated.')
+	grid_parser.add_argument(
+		'-x',
+		'--scale',
+		type=float,
+		default=0.25,
+		help='Size of the grid images relative to the scans. Smaller is faster. Use 1 for full size.')
 	grid_parser.set_defaults(action=grid)
 
 	blob_parser = subparsers.add_parser(
@@ -301,7 +600,49 @@ def main():
 		'--dir_out',
 		type=str,
 		default=None,
-		help='Optional output folder. If not specified, output is placed in tile/.')
+		help='Optional output folder. If not specified, output is placed in tile/ or tfrecord/.')
+	blob_parser.add_argument(
+		'-e',
+		'--emit',
+		type=str,
+		choices=['tile', 'tfrecord'],
+		default='tile',
+		help='Save each tile as a .png file, or write tiles straight into .tfrecord shards.')
+	blob_parser.add_argument(
+		'-m',
+		'--max_shard_size',
+		type=int,
+		default=500*1024*1024,
+		help='Maximum shard size in bytes. Only used with --emit=tfrecord.')
+	blob_parser.add_argument(
+		'-w',
+		'--workers',
+		type=int,
+		default=os.cpu_count(),
+		help='Number of worker processes. Defaults to the number of logical cores.')
+	blob_parser.add_argument(
+		'--seed',
+		type=int,
+		default=None,
+		help='Seed for the random angles. The same seed cuts the same tiles. If not specified, one is chosen and printed.')
+	blob_parser.add_argument(
+		'-b',
+		'--batch_size',
+		type=int,
+		default=16,
+		help='Tiles cut per batch.')
+	blob_parser.add_argument(
+		'-i',
+		'--min_ink',
+		type=float,
+		default=0,
+		help='Reject tiles with less than this fraction of ink around them, between 0 and 1. ' +
+		'Ink is measured as the darkness of the pixels. Default 0 keeps every tile.')
+	blob_parser.add_argument(
+		'-f',
+		'--force',
+		action='store_true',
+		help='Cut every page again, even if its manifest shows nothing changed.')
 	blob_parser.set_defaults(action=blob)
 
 	specimen_parser = subparsers.add_parser(
@@ -333,14 +674,38 @@ def main():
 			type=int,
 			default=18,
 			help='Columns in the grid.')
-	for subparser in [blob_parser, specimen_parser]:
+	blob_parser.add_argument(
+		'-p',
+		'--pixels',
+		type=int,
+		nargs='+',
+		choices=[4, 8, 16, 32, 64, 128, 256, 512, 1024],
+		required=True,
+		help='How many square pixels each tile will have. Must be a power of 2 between 4 and 1024. ' +
+		'Several values cut the tiles at the highest, and downsample them to the others in the same pass.')
+	specimen_parser.add_argument(
+		'-p',
+		'--pixels',
+		type=int,
+		choices=[4, 8, 16, 32, 64, 128, 256, 512, 1024],
+		required=True,
+		help='How many square pixels each tile will have. Must be a power of 2 between 4 and 1024.')
+	for subparser in [blob_parser, specimen_parser, rotateflip_parser]:
+		subparser.add_argument(
+			'-k',
+			'--codec',
+			type=str,
+			choices=list(codec.EXTENSIONS),
+			default='png',
+			help='Format of the saved tiles: png, lossless webp, or raw uint8 arrays (.npy). ' +
+			'Shards written with --emit=tfrecord are always png.')
 		subparser.add_argument(
-			'-p',
-			'--pixels',
+			'-l',
+			'--compress_level',
 			type=int,
-			choices=[4, 8, 16, 32, 64, 128, 256, 512, 1024],
-			required=True,
-			help='How many square pixels each tile will have. Must be a power of 2 between 4 and 1024.')
+			choices=range(10),
+			default=6,
+			help='Compression level from 0 (fastest) to 9 (smallest).')
 	for subparser in [grid_parser, blob_parser, specimen_parser]:
 		subparser.add_argument(
 			'dpi',
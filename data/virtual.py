@@ -0,0 +1,180 @@
+import argparse
+import extract
+import numpy as np
+import os
+import page_cache
+from pathlib import Path
+from PIL import Image
+import tile
+
+# A virtual blob dataset is an index of every tile that tile.py blob would cut:
+# its page, center, angle and flip. Tiles are cut from the cached page rasters
+# only when they are read, so nothing but the index is stored.
+
+
+def index(args: argparse.Namespace):
+	if args.file_out is None:
+		stem = Path(args.dir_in).stem
+		file_out = f'virtual/{stem}.npz'
+	else:
+		file_out = args.file_out
+	os.makedirs(Path(file_out).parent, exist_ok=True)
+	pages = len(os.listdir(args.dir_in))
+
+	# Same centers and angles as tile.py blob with the same seed.
+	records = []
+	for page in range(pages):
+		_, ys, xs = tile.blob_geometry(
+			args.dpi, args.rows, args.cols, args.pixels, args.steps, page)
+		for row, y in enumerate(ys):
+			thetas, flips = tile.blob_angles(args.seed, page, row, len(xs))
+			for x, theta, flip in zip(xs, thetas, flips):
+				records.append((page, x, y, theta, flip))
+	records = np.array(records, dtype=np.int32).reshape(-1, 5)
+
+	scans = [os.path.abspath(f'{args.dir_in}/{page:02}.png') for page in range(pages)]
+	np.savez_compressed(
+		file_out,
+		page=records[:, 0].astype(np.uint16),
+		x=records[:, 1],
+		y=records[:, 2],
+		theta=records[:, 3].astype(np.uint16),
+		flip=records[:, 4].astype(np.uint8),
+		scans=np.array(scans),
+		pixels=args.pixels,
+		seed=args.seed)
+	print(f'{len(records)} tiles indexed in {file_out}')
+
+
+class VirtualBlob:
+	# Reads tiles from an index written by `python virtual.py`.
+	# Epoch 0 has the same angles as the index, and so the same tiles as tile.py blob.
+	# Every later epoch draws fresh angles and flips for the same centers.
+
+	def __init__(self, index_path, batch_size=16):
+		with np.load(index_path) as data:
+			self.page = data['page']
+			self.x = data['x']
+			self.y = data['y']
+			self.theta = data['theta']
+			self.flip = data['flip']
+			self.scans = [str(scan) for scan in data['scans']]
+			self.pixels = int(data['pixels'])
+			self.seed = int(data['seed'])
+		self.batch_size = batch_size
+
+	def __len__(self):
+		return len(self.page)
+
+	def __iter__(self):
+		return self.tiles()
+
+	def angles(self, epoch):
+		if epoch == 0:
+			return self.theta, self.flip
+		rng = np.random.default_rng([self.seed, epoch])
+		return rng.integers(0, 360, len(self)), rng.integers(0, 2, len(self))
+
+	def tiles(self, epoch=0, shuffle=False, shard=0, num_shards=1):
+		# Yields (pixels, pixels, 1) uint8 arrays.
+		# shard and num_shards split the index between parallel readers.
+		thetas, flips = self.angles(epoch)
+		order = np.arange(len(self))
+		if shuffle:
+			order = np.random.default_rng([self.seed, epoch, 1]).permutation(order)
+		order = order[shard::num_shards]
+		pages = {}
+		for start in range(0, len(order), self.batch_size):
+			batch = order[start:start + self.batch_size]
+			# Tiles in a batch are cut page by page.
+			for page in np.unique(self.page[batch]):
+				if page not in pages:
+					# Made into an Image once, as Pillow copies color pages whole.
+					pages[page] = Image.fromarray(page_cache.load_page(self.scans[page]))
+				i = batch[self.page[batch] == page]
+				tiles = extract.cut_tiles(
+					pages[page],
+					self.x[i],
+					self.y[i],
+					thetas[i],
+					flips[i],
+					self.pixels)
+				for tile in tiles:
+					if tile.ndim == 2:
+						tile = tile[..., None]
+					yield tile
+
+
+def dataset(index_path, epochs=None, shuffle=True, batch_size=16):
+	# tf.data source over a virtual blob dataset.
+	# Each epoch draws fresh angles. epochs=None repeats indefinitely.
+	import tensorflow as tf
+	blob = VirtualBlob(index_path, batch_size)
+	signature = tf.TensorSpec((blob.pixels, blob.pixels, 1), tf.uint8)
+
+	def epoch_dataset(epoch):
+		return tf.data.Dataset.from_generator(
+			lambda epoch: blob.tiles(int(epoch), shuffle),
+			args=(epoch,),
+			output_signature=signature)
+
+	epochs = tf.data.Dataset.counter() if epochs is None else tf.data.Dataset.range(epochs)
+	return epochs.flat_map(epoch_dataset)
+
+
+def main():
+
+	parser = argparse.ArgumentParser(
+		description='Index the tiles of a blob, to be cut on the fly during training.')
+
+	parser.add_argument(
+		'-p',
+		'--pixels',
+		type=int,
+		choices=[4, 8, 16, 32, 64, 128, 256, 512, 1024],
+		required=True,
+		help='How many square pixels each tile will have. Must be a power of 2 between 4 and 1024.')
+	parser.add_argument(
+		'-s',
+		'--steps',
+		type=int,
+		required=True,
+		help='Inverse of the distance that adjacent tiles are separated by, as in tile.py blob.')
+	parser.add_argument(
+		'--seed',
+		type=int,
+		default=0,
+		help='Seed for the random angles, as in tile.py blob.')
+	parser.add_argument(
+		'-r',
+		'--rows',
+		type=int,
+		default=12,
+		help='Rows in the grid.')
+	parser.add_argument(
+		'-c',
+		'--cols',
+		type=int,
+		default=18,
+		help='Columns in the grid.')
+	parser.add_argument(
+		'-o',
+		'--file_out',
+		type=str,
+		default=None,
+		help='Optional output file. If not specified, the index is placed in virtual/.')
+	parser.add_argument(
+		'dpi',
+		type=int,
+		help='dpi of scans as determined by the scanner.')
+	parser.add_argument(
+		'dir_in',
+		help='Folder of source images. Example: "scan/blob"')
+	parser.set_defaults(action=index)
+
+	args = parser.parse_args()
+	args.action(args)
+
+
+if __name__ == '__main__':
+	main()